@@ -0,0 +1,241 @@
+# Benchmarks of the hw1 image operations and the hw3 ray tracer on fixed synthetic inputs.
+#
+# Usage (from the root of the repository):
+#   python benchmarks/run_benchmarks.py --output baseline.json
+#   python benchmarks/run_benchmarks.py --baseline baseline.json
+#
+# The first run writes the report that later runs (on the same machine) are compared against.
+#
+# Every benchmark is timed --repeat times (the fastest timing is reported) and then run once more under tracemalloc
+# for its peak memory.
+# The results are printed as JSON (or written to --output). With --baseline every benchmark is timed at least
+# MIN_BASELINE_REPEAT times, the median times are compared to a stored result and the script exits with status 1 if
+# one of them got slower by more than --tolerance and by more than --noise-floor seconds.
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'hw3'))
+sys.path.append(os.path.join(ROOT, 'hw1'))
+
+import hw3
+from render_stats import collect_stats
+from helper_classes import DirectionalLight, Mesh, Plane, PointLight, Sphere
+from ex1_loader import load_ex1
+
+IMAGE_SIZES = [(120, 160), (240, 320), (480, 640)]
+SPHERE_COUNTS = [1, 8, 32]
+TRIANGLE_COUNTS = [32, 512, 8192]
+
+# The benchmarks run by --quick, the smallest input of every benchmark
+QUICK_BENCHMARKS = [
+    'reshape_bilinear/160x120', 'gradient_magnitude/160x120', 'reshape_seam_carving/160x120',
+    'render_scene/spheres-1', 'render_scene_batched/spheres-1',
+    'render_scene/triangles-32', 'render_scene_batched/triangles-32',
+]
+SCALAR_SCREEN_SIZE = (48, 32)
+BATCHED_SCREEN_SIZE = (256, 192)
+MAX_DEPTH = 3
+MIN_TIMING_SECONDS = 0.05
+# A comparison with a baseline times every benchmark at least this many times and compares the medians
+MIN_BASELINE_REPEAT = 5
+SEED = 0
+
+
+# A smooth colour pattern with some noise, so seam carving has structure to follow
+def synthetic_image(shape):
+    rng = np.random.default_rng(SEED)
+    height, width = shape
+    y, x = np.mgrid[0:height, 0:width] / max(shape)
+    image = np.stack([128 + 100 * np.sin(9 * x) * np.cos(6 * y),
+                      128 + 80 * np.sin(5 * (x + y)),
+                      128 + 60 * np.cos(14 * x)], axis=-1)
+    image += rng.normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def base_scene():
+    floor = Plane([0, 1, 0], [0, -1, 0])
+    floor.set_material([0.2, 0.2, 0.2], [0.6, 0.6, 0.6], [0.3, 0.3, 0.3], 10, 0.3)
+    background = Plane([0, 0, 1], [0, 0, -20])
+    background.set_material([0.3, 0.1, 0.1], [0.6, 0.2, 0.2], [0.1, 0.1, 0.1], 10, 0.1)
+    lights = [PointLight(intensity=np.array([1, 1, 1]), position=np.array([2, 3, 1]), kc=0.1, kl=0.1, kq=0.1),
+              DirectionalLight(intensity=np.array([0.5, 0.5, 0.5]), direction=np.array([1, 1, 1]))]
+    return [floor, background], lights
+
+
+# count spheres on a jittered grid in front of the camera
+def sphere_scene(count):
+    rng = np.random.default_rng(SEED)
+    objects, lights = base_scene()
+    side = int(np.ceil(np.sqrt(count)))
+    for i in range(count):
+        center = [(i % side - (side - 1) / 2) * 2.4 / side, (i // side - (side - 1) / 2) * 1.6 / side, -2.5]
+        sphere = Sphere(np.array(center) + rng.uniform(-0.05, 0.05, 3), 0.9 / side)
+        sphere.set_material(*rng.uniform(0.1, 0.9, (3, 3)), 20, 0.4)
+        objects.append(sphere)
+    return objects, lights
+
+
+# A bumpy height field mesh of about count triangles facing the camera
+def triangle_scene(count):
+    rng = np.random.default_rng(SEED)
+    objects, lights = base_scene()
+    n = max(int(np.sqrt(count / 2)), 1)
+    x, y = np.meshgrid(np.linspace(-1.5, 1.5, n + 1), np.linspace(-1, 1, n + 1))
+    z = -2.5 + 0.1 * rng.standard_normal(x.shape)
+    vertices = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+    corner = (np.arange(n)[:, None] * (n + 1) + np.arange(n)).ravel()
+    faces = np.concatenate([np.stack([corner, corner + 1, corner + n + 1], axis=1),
+                            np.stack([corner + 1, corner + n + 2, corner + n + 1], axis=1)])
+    # The ray tracer only sees a face from the side its normal points to, flip the faces that look away
+    hidden = ~Mesh(vertices, faces).visible
+    faces[hidden] = faces[hidden][:, [0, 2, 1]]
+    mesh = Mesh(vertices, faces)
+    mesh.set_material([0.1, 0.3, 0.1], [0.3, 0.7, 0.3], [0.4, 0.4, 0.4], 30, 0.3)
+    mesh.apply_materials_to_triangles()
+    objects.append(mesh)
+    return objects, lights
+
+
+# Each benchmark is (name, setup, run, pixels, renders): setup builds the input outside of the timing and run(input)
+# is timed. pixels is the number of output pixels of one run, renders tells if the rays it traces are counted.
+def get_benchmarks():
+    ex1 = load_ex1()
+    benchmarks = []
+    for height, width in IMAGE_SIZES:
+        size = '{}x{}'.format(width, height)
+        image = synthetic_image((height, width))
+        benchmarks.append(('reshape_bilinear/' + size, lambda image=image: image,
+                           lambda image: ex1.reshape_bilinear(image, (image.shape[0] * 3 // 2, image.shape[1] // 2)),
+                           (height * 3 // 2) * (width // 2), False))
+        benchmarks.append(('gradient_magnitude/' + size, lambda image=image: image,
+                           lambda image: ex1.gradient_magnitude(image, ex1.greyscale_wt), height * width, False))
+        new_shape = (height - height // 20, width - width // 10)
+        benchmarks.append(('reshape_seam_carving/' + size, lambda image=image: image,
+                           lambda image, new_shape=new_shape: ex1.reshape_seam_carving(image, new_shape, 0),
+                           new_shape[0] * new_shape[1], False))
+
+    camera = np.array([0, 0, 1])
+    ambient = np.array([0.1, 0.1, 0.1])
+    scenes = [('spheres', count, sphere_scene) for count in SPHERE_COUNTS]
+    scenes += [('triangles', count, triangle_scene) for count in TRIANGLE_COUNTS]
+    for kind, count, make_scene in scenes:
+        for name, render, screen_size in (('render_scene', hw3.render_scene, SCALAR_SCREEN_SIZE),
+                                          ('render_scene_batched', hw3.render_scene_batched, BATCHED_SCREEN_SIZE)):
+            pixels = screen_size[0] * screen_size[1]
+            benchmarks.append(('{}/{}-{}'.format(name, kind, count),
+                               lambda make_scene=make_scene, count=count: make_scene(count),
+                               lambda scene, render=render, screen_size=screen_size: render(
+                                   camera, ambient, scene[1], scene[0], screen_size, MAX_DEPTH),
+                               pixels, True))
+    return benchmarks
+
+
+# Fast benchmarks are run several times per timing, so that a timing takes at least MIN_TIMING_SECONDS and
+# is not lost in the resolution of the clock. The reported times are per run.
+# The rays of a render (primary, shadow and reflection) are counted with render_stats in the memory run.
+def run_benchmark(setup, run, pixels, renders, repeat):
+    data = setup()
+    start = time.perf_counter()
+    run(data)
+    number = max(1, int(MIN_TIMING_SECONDS / max(time.perf_counter() - start, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run(data)
+        times.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    if renders:
+        with collect_stats() as stats:
+            run(data)
+    else:
+        run(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = min(times)
+    result = {'seconds': seconds, 'median_seconds': float(np.median(times)), 'repeat': repeat, 'number': number,
+              'peak_memory_bytes': peak, 'pixels_per_sec': pixels / seconds}
+    if renders:
+        result['rays'] = stats.summary()['rays']
+        result['rays_per_sec'] = stats.summary()['total_rays'] / seconds
+    return result
+
+
+def run_benchmarks(repeat=3, name_filter=None, quick=False):
+    results = {}
+    for name, setup, run, pixels, renders in get_benchmarks():
+        if name_filter and name_filter not in name:
+            continue
+        if quick and name not in QUICK_BENCHMARKS:
+            continue
+        results[name] = run_benchmark(setup, run, pixels, renders, repeat)
+        print('{:<45} {:10.4f}s {:10.1f} MB'.format(name, results[name]['seconds'],
+                                                    results[name]['peak_memory_bytes'] / 2 ** 20), file=sys.stderr)
+    return {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                 'processor': platform.processor(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results,
+    }
+
+
+# Returns the benchmarks of report whose median time grew by more than tolerance (a fraction) and by more than
+# noise_floor seconds over the baseline, as (name, baseline seconds, seconds) tuples. The floor keeps the jitter of
+# benchmarks that take a few milliseconds from counting as a regression. Benchmarks missing from either side are
+# skipped.
+def compare_to_baseline(report, baseline, tolerance, noise_floor):
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median_seconds']
+        new = result['median_seconds']
+        if new > old * (1 + tolerance) and new - old > noise_floor:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hw1 image operations and the hw3 ray tracer.')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='a JSON report to compare the times against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='the fraction a time may grow over the baseline before it counts as a regression')
+    parser.add_argument('--noise-floor', type=float, default=0.005,
+                        help='the seconds a time must grow by, on top of --tolerance, to count as a regression')
+    parser.add_argument('--repeat', type=int, default=MIN_BASELINE_REPEAT,
+                        help='how many times every benchmark is timed, at least {} with --baseline'.format(
+                            MIN_BASELINE_REPEAT))
+    parser.add_argument('--filter', help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--quick', action='store_true', help='only run the smallest input of every benchmark')
+    args = parser.parse_args(argv)
+
+    repeat = max(args.repeat, MIN_BASELINE_REPEAT) if args.baseline else args.repeat
+    report = run_benchmarks(repeat, args.filter, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance, args.noise_floor)
+        for name, old, new in regressions:
+            print('regression: {} {:.4f}s -> {:.4f}s ({:+.0%})'.format(name, old, new, new / old - 1),
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
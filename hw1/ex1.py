@@ -1,25 +1,42 @@
 # Pre-requisites
+import os
+import pickle
+import queue
+import threading
+import time
+import warnings
 import numpy as np
-import math
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
-from functools import partial
-from numba import jit
-import sys
+from functools import partial, lru_cache
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Global parameter
 greyscale_wt = [0.299, 0.587, 0.114]
+# The size of the float64 buffers of reshape_bilinear, which processes that many bytes of rows at a time
+BILINEAR_BLOCK_BYTES = 1 << 20
 
-def get_greyscale_image(image, colour_wts):
+def get_greyscale_image(image, colour_wts, out=None, dtype=np.float64, scratch=None):
     """
     Gets an image and weights of each colour and returns the image in greyscale
     :param image: The original image
     :param colour_wts: the weights of each colour in rgb (ints > 0)
+    :param out: an optional (height, width) array the greyscale image is written into
+    :param dtype: the type of the greyscale image when out is not given (np.float64 or np.float32)
+    :param scratch: an optional (height, width) array of the type of out for the weighted channels, with out and
+        scratch given nothing is allocated
     :returns: the image in greyscale
     """
-    R, G, B = image[:,:,0], image[:,:,1], image[:,:,2]
-    greyscale_image = colour_wts[0] * R + colour_wts[1] * G + colour_wts[2] * B
-    return greyscale_image
+    if out is None:
+        out = np.empty(image.shape[:2], dtype=dtype)
+    if scratch is None:
+        scratch = np.empty_like(out)
+    weights = np.asarray(colour_wts, dtype=out.dtype)
+    np.multiply(image[:, :, 0], weights[0], out=out)
+    for c in (1, 2):
+        out += np.multiply(image[:, :, c], weights[c], out=scratch)
+    return out
     
 def reshape_bilinear(image, new_shape):
     """
@@ -30,101 +47,115 @@ def reshape_bilinear(image, new_shape):
     """
     in_height, in_width, c = image.shape  # the dimension of an original image 
     out_height, out_width = new_shape     # the dimension of a desired image
-    new_image = np.zeros((out_height, out_width, c))      # initiallize an image with desired height and width
     
     # Calculates a horizontal, and a vertical scaling factor
     w_scale_factor = in_width / out_width if out_height != 0 else 0
     h_scale_factor = in_height / out_height if out_width != 0 else 0
     
-    # Resizes an image to new shape using bilinear interpolation method
-    for i in range(out_height):
-        for j in range(out_width):
-            # map the coordinates back to the original image
-            x = i * h_scale_factor
-            y = j * w_scale_factor
-            # calculate the coordinate values for 4 surrounding pixels.
-            x_floor = math.floor(x)
-            x_ceil = min(in_height - 1, math.ceil(x))
-            y_floor = math.floor(y)
-            y_ceil = min(in_width - 1, math.ceil(y))
-
-            if (x_ceil == x_floor) and (y_ceil == y_floor):
-                q = image[int(x), int(y), :]
-            elif x_ceil == x_floor:
-                q1 = image[int(x), int(y_floor), :]
-                q2 = image[int(x), int(y_ceil), :]
-                q = q1 * (y_ceil - y) + q2 * (y - y_floor)
-            elif y_ceil == y_floor:
-                q1 = image[int(x_floor), int(y), :]
-                q2 = image[int(x_ceil), int(y), :]
-                q = (q1 * (x_ceil - x)) + (q2 * (x - x_floor))
-            else:
-                v1 = image[x_floor, y_floor, :]
-                v2 = image[x_ceil, y_floor, :]
-                v3 = image[x_floor, y_ceil, :]
-                v4 = image[x_ceil, y_ceil, :]
-
-                q1 = v1 * (x_ceil - x) + v2 * (x - x_floor)
-                q2 = v3 * (x_ceil - x) + v4 * (x - x_floor)
-                q = q1 * (y_ceil - y) + q2 * (y - y_floor)
-                
-            new_image[i,j,:] = q
-            
-    return new_image.astype(np.uint8)
+    # The interpolation is separable: first blend the two surrounding rows of every output row,
+    # then the two surrounding columns of every output column
+    x_floor, x_ceil, x_floor_wt, x_ceil_wt = get_bilinear_table(in_height, out_height, h_scale_factor)
+    y_floor, y_ceil, y_floor_wt, y_ceil_wt = get_bilinear_table(in_width, out_width, w_scale_factor)
+    y_floor_wt, y_ceil_wt = y_floor_wt[None, :, None], y_ceil_wt[None, :, None]
+    new_image = np.empty((out_height, out_width, c), dtype=np.uint8)
+    # The output rows are done a few at a time in buffers that stay in the cache, the gathers (np.take) and the
+    # products are written into them in place. The arithmetic is the float64 one of the loop version, so the
+    # result is the same to the bit.
+    block = max(1, BILINEAR_BLOCK_BYTES // (4 * 8 * c * max(in_width, out_width)))
+    rows, rows_tmp = np.empty((2, block, in_width, c))
+    cols, cols_tmp = np.empty((2, block, out_width, c))
+    for start in range(0, out_height, block):
+        part = slice(start, min(start + block, out_height))
+        n = part.stop - start
+        np.multiply(np.take(image, x_floor[part], axis=0), x_floor_wt[part, None, None], out=rows[:n])
+        np.multiply(np.take(image, x_ceil[part], axis=0), x_ceil_wt[part, None, None], out=rows_tmp[:n])
+        rows[:n] += rows_tmp[:n]
+        np.take(rows[:n], y_floor, axis=1, out=cols[:n])
+        cols[:n] *= y_floor_wt
+        np.take(rows[:n], y_ceil, axis=1, out=cols_tmp[:n])
+        cols_tmp[:n] *= y_ceil_wt
+        cols[:n] += cols_tmp[:n]
+        new_image[part] = cols[:n]
+    return new_image
+
+@lru_cache(maxsize=64)
+def get_bilinear_table(in_size, out_size, scale_factor):
+    """
+    Calculates the index and weight vectors of one axis of reshape_bilinear, they are cached so images of the same
+    size reuse them
+    :param in_size: the size of the axis in the original image
+    :param out_size: the size of the axis in the resized image
+    :param scale_factor: in_size / out_size
+    :returns: the floor and ceil indices of every output coordinate and their weights
+    """
+    # map the coordinates back to the original image
+    coords = np.arange(out_size) * scale_factor
+    floor = np.floor(coords).astype(int)
+    ceil = np.minimum(in_size - 1, np.ceil(coords)).astype(int)
+    # When both neighbours are the same pixel it is taken as is
+    same = floor == ceil
+    floor_wt = np.where(same, 1.0, ceil - coords)
+    ceil_wt = np.where(same, 0.0, coords - floor)
+    for table in (floor, ceil, floor_wt, ceil_wt):
+        table.setflags(write=False)
+    return floor, ceil, floor_wt, ceil_wt
     
-def gradient_magnitude(image, colour_wts):
+def gradient_magnitude(image, colour_wts, out=None, dtype=np.float64, greyscale_out=None, scratch=None):
     """
     Calculates the gradient image of a given image
     :param image: The original image
     :param colour_wts: the weights of each colour in rgb (> 0) 
+    :param out: an optional (height, width) array the gradient image is written into
+    :param dtype: the type of the gradient image when out is not given (np.float64 or np.float32)
+    :param greyscale_out: an optional (height, width) array for the intermediate greyscale image
+    :param scratch: an optional (height, width) array for the vertical differences, with out, greyscale_out and
+        scratch given nothing is allocated
     :returns: The gradient image
     """
-    greyscale = get_greyscale_image(image, colour_wts)
-    height, width = greyscale.shape
-    gradient = np.zeros((height, width))
-    # fill the image
-    for i in range(height - 1):
-        for j in range(width - 1):
-            dx = greyscale[i + 1][j] - greyscale[i, j]
-            dy = greyscale[i][j + 1] - greyscale[i, j]
-            magnitude = (np.sqrt(np.power(dx, 2) + np.power(dy, 2)))
-            gradient[i, j] = magnitude
-
-    # fill the last row and colum
-    for j in range(width - 1):
-        dx = greyscale[0][j] - greyscale[height - 1, j]
-        dy = greyscale[height - 1][j + 1] - greyscale[height - 1, j]
-        magnitude = (np.sqrt(np.power(dx, 2) + np.power(dy, 2)))
-        gradient[height - 1, j] = magnitude
-    for i in range(height - 1):
-        dx = greyscale[i + 1][width - 1] - greyscale[i, width - 1]
-        dy = greyscale[i][0] - greyscale[i, width - 1]
-        magnitude = (np.sqrt(np.power(dx, 2) + np.power(dy, 2)))
-        gradient[i, width - 1] = magnitude
-    # fill the corner pixel
-    dx = greyscale[0][width - 1] - greyscale[height - 1, width - 1]
-    dy = greyscale[height - 1][0] - greyscale[height - 1, width - 1]
-    magnitude = (np.sqrt(np.power(dx, 2) + np.power(dy, 2)))
-    gradient[height - 1, width - 1] = magnitude
-    return gradient
+    if out is not None:
+        dtype = out.dtype
+    greyscale = get_greyscale_image(image, colour_wts, out=greyscale_out, dtype=dtype, scratch=scratch)
+    if out is None:
+        out = np.empty_like(greyscale)
+    # The difference to the pixel below and to the pixel on the right,
+    # the last row and the last column wrap around to the first ones
+    dx = np.empty_like(greyscale) if scratch is None else scratch
+    np.subtract(greyscale[1:], greyscale[:-1], out=dx[:-1])
+    np.subtract(greyscale[0], greyscale[-1], out=dx[-1])
+    np.subtract(greyscale[:, 1:], greyscale[:, :-1], out=out[:, :-1])
+    np.subtract(greyscale[:, 0], greyscale[:, -1], out=out[:, -1])
+    np.square(dx, out=dx)
+    np.square(out, out=out)
+    out += dx
+    return np.sqrt(out, out=out)
 
 
 # Implementation of seams carving algorithm
 # We added a bunch of auxiliary methods.
 
-def get_vertical_seams(image, seams_number):
+def get_vertical_seams(image, seams_number, pyramid_levels=0, dtype=np.float64):
+    if pyramid_levels:
+        return get_vertical_seams_pyramid(image, seams_number, pyramid_levels, dtype=dtype)
     vertical_seams_list = []
+    # The image, the greyscale and energy maps and the cost matrices are allocated once: the maps are kept up to
+    # date as seams are removed and every array shrinks by shifting its rows left in place (see remove_seam_in_place)
+    image = np.array(image)
+    M, backtrack = np.empty(image.shape[:2], dtype=dtype), np.empty(image.shape[:2], dtype=int)
+    greyscale = get_greyscale_image(image, greyscale_wt, dtype=dtype, scratch=M)
+    energy_map = gradient_magnitude(image, greyscale_wt, dtype=dtype, greyscale_out=M)
     for i in range(seams_number):
-        M, backtrack = calculate_cost_matrix(image)
-        vertical_seams_list.append(find_seam(M, backtrack))
-        image = remove_seam(image, vertical_seams_list[i])
+        width = greyscale.shape[1]
+        forward_energy(energy_map, greyscale, out=M[:, :width], backtrack_out=backtrack[:, :width])
+        vertical_seams_list.append(find_seam(M[:, :width], backtrack[:, :width]))
+        image = remove_seam_in_place(image, seam_columns(vertical_seams_list[i]))
+        greyscale, energy_map = remove_seam_from_maps(greyscale, energy_map, vertical_seams_list[i])
     return vertical_seams_list, image
                   
         
-def get_horizontal_seams(image, seams_number):
+def get_horizontal_seams(image, seams_number, pyramid_levels=0, dtype=np.float64):
     # Rotate an array by 90 degrees in the plane k times.
     image = np.rot90(image, k=1)
-    horizontal_seams_list, image = get_vertical_seams(image, seams_number)
+    horizontal_seams_list, image = get_vertical_seams(image, seams_number, pyramid_levels, dtype)
     if seams_number != 0:
         # Reverse the order of elements in an array along the given axis
         horizontal_seams_list = np.flip(horizontal_seams_list, axis=2) 
@@ -132,34 +163,56 @@ def get_horizontal_seams(image, seams_number):
     return horizontal_seams_list, image
         
 def calculate_cost_matrix(image):
-    height, width, _ = image.shape
     energy_map = gradient_magnitude(image, greyscale_wt)
-    image = get_greyscale_image(image, greyscale_wt)                       
+    image = get_greyscale_image(image, greyscale_wt)
     # M represents the energy of the lowest-energy vertical seam that starts at the top of the image
-    M = calculate_cost(energy_map, image)
-    # Back pointers to know which of the pixels in the previous row led to that energy
-    backtrack = np.zeros_like(M, dtype=int)
-    # Skip the first row in the following loop.
-    for i in range(1, height):
-        for j in range(0, width):
-            # Determine the range of x values to iterate over in the previous
-            # row. The range depends on if the current pixel is in the middle of
-            # the image, or on one of the edges.
-            if j == 0:
-                idx = np.argmin(M[i-1, j : j+2])
-                backtrack[i, j] = idx + j
-            else:
-                idx = np.argmin(M[i - 1, j - 1:j + 2])
-                backtrack[i, j] = idx + j - 1
-    return M, backtrack
-               
+    # backtrack holds the back pointers to know which of the pixels in the previous row led to that energy
+    return forward_energy(energy_map, image)
+
 def calculate_cost(energy_map, image):
-    M = energy_map.copy()
-    for row in range(1, M.shape[0]):
-        for col in range(M.shape[1]):
-            M[row, col] += find_min_neighbor_cost(M, image, row, col)
+    M, _ = forward_energy(energy_map, image)
     return M
 
+def forward_energy(energy_map, image, out=None, backtrack_out=None):
+    """
+    Fills the forward-energy cost matrix and its back pointers in one pass, a whole row at a time
+    :param energy_map: the gradient magnitude of the image
+    :param image: the image in greyscale
+    :param out: an optional (height, width) array the cost matrix is written into, it is float64 otherwise
+    :param backtrack_out: an optional (height, width) int array the back pointers are written into
+    :returns: the cost matrix M and the backtrack matrix
+    """
+    height, width = energy_map.shape
+    if out is None:
+        M = energy_map.astype(np.float64)
+    else:
+        M = out
+        M[...] = energy_map
+    if backtrack_out is None:
+        backtrack = np.zeros((height, width), dtype=int)
+    else:
+        backtrack = backtrack_out
+        backtrack[0] = 0
+    columns = np.arange(width)
+    for row in range(1, height):
+        up, current, prev = image[row - 1], image[row], M[row - 1]
+        # The cost of the new edge between the left and right neighbours, zero on the image borders
+        middle = np.zeros(width, dtype=M.dtype)
+        middle[1:-1] = np.abs(current[2:] - current[:-2])
+        left = np.full(width, np.inf, dtype=M.dtype)
+        left[1:] = prev[:-1] + (middle[1:] + np.abs(up[1:] - current[:-1]))
+        right = np.full(width, np.inf, dtype=M.dtype)
+        right[:-1] = prev[1:] + (middle[:-1] + np.abs(current[1:] - up[:-1]))
+        M[row] += np.minimum(np.minimum(left, prev + middle), right)
+
+        # Back pointers to the lowest of the (up to) three pixels above, the leftmost one on ties
+        prev_left = np.concatenate(([np.inf], prev[:-1]))
+        prev_right = np.concatenate((prev[1:], [np.inf]))
+        go_left = (prev_left <= prev) & (prev_left <= prev_right)
+        go_up = ~go_left & (prev <= prev_right)
+        backtrack[row] = columns + np.where(go_left, -1, np.where(go_up, 0, 1))
+    return M, backtrack
+
 def find_seam(M, backtrack):
     j = np.argmin(M[-1])
     seam = []
@@ -175,30 +228,69 @@ def remove_seam(image, seam):
         mask[s[0], s[1]] = False
     image = image[mask].reshape(height, width - 1, rgb)
     return image
-      
-def calc_edges(image, height, width, neighbor):
-    cost = 0
-    if width == 0 and neighbor == 'vertical':
-        return cost
-    elif width == image.shape[1] - 1 and neighbor == 'vertical':
-        return cost
-    if width != 0 and width != image.shape[1] - 1:
-        cost = abs(image[height, width + 1] - image[height, width - 1])
-    if neighbor == 'left':
-        cost += abs(image[height - 1, width] - image[height, width - 1])
-    elif neighbor == 'right':
-        cost += abs(image[height, width + 1] - image[height - 1, width])
-    return cost
-
-def find_min_neighbor_cost(matrix, image, height, width):
-    left, vertical, right = sys.maxsize, sys.maxsize, sys.maxsize
-    if width != 0:
-        left = matrix[height - 1, width - 1] + calc_edges(image, height, width, 'left')
-    if width != matrix.shape[1] - 1:
-        right = matrix[height - 1, width + 1] + calc_edges(image, height, width, 'right')
-        
-    vertical = matrix[height - 1, width] + calc_edges(image, height, width, 'vertical')
-    return np.min(np.array([left, vertical, right]))
+
+def seam_columns(seam):
+    """
+    :param seam: a seam, a list of [row, column] pairs
+    :returns: the column of the seam in every row
+    """
+    columns = np.empty(len(seam), dtype=int)
+    for row, col in seam:
+        columns[row] = col
+    return columns
+
+def remove_seam_in_place(array, columns):
+    """
+    Removes one pixel from every row of an array by shifting the pixels right of it one column left, nothing is
+    allocated or copied besides the shifted pixels
+    :param array: a (height, width, ...) array, it is overwritten
+    :param columns: the column of the removed pixel in every row
+    :returns: the view of the first width - 1 columns of array
+    """
+    width = array.shape[1]
+    for row, col in enumerate(columns):
+        array[row, col:width - 1] = array[row, col + 1:width]
+    return array[:, :width - 1]
+
+def remove_seam_from_maps(greyscale, energy_map, seam):
+    """
+    Removes a seam from the greyscale image and its energy map in place (see remove_seam_in_place), and recomputes
+    the energy only next to the seam
+    :param greyscale: the image in greyscale, it is overwritten
+    :param energy_map: the gradient magnitude of greyscale, it is overwritten
+    :param seam: the seam to remove, a list of [row, column] pairs
+    :returns: the greyscale image and energy map without the seam, views of the given ones
+    """
+    height, width = greyscale.shape
+    columns = seam_columns(seam)
+    greyscale = remove_seam_in_place(greyscale, columns)
+    energy_map = remove_seam_in_place(energy_map, columns)
+    width -= 1
+    if width == 0:
+        return greyscale, energy_map
+    # The energy of a pixel depends on the pixels to its right and below it, so after removing the seam it only
+    # changes from two columns left of the seam up to the seam column of the next row, which is at most one
+    # column away. The last row (whose next row is the first one) and the last column (whose right neighbour is
+    # the first column) wrap around, so they are recomputed whole.
+    band_rows = np.repeat(np.arange(height - 1), 4)
+    band_cols = np.clip((columns[:-1, None] + np.arange(-2, 2)).ravel(), 0, width - 1)
+    rows = np.concatenate((band_rows, np.full(width, height - 1), np.arange(height)))
+    cols = np.concatenate((band_cols, np.arange(width), np.full(height, width - 1)))
+    energy_map[rows, cols] = pixel_gradient_magnitude(greyscale, rows, cols)
+    return greyscale, energy_map
+
+def pixel_gradient_magnitude(greyscale, rows, cols):
+    """
+    Calculates the gradient magnitude of the given pixels, with the same wrap-around as gradient_magnitude
+    :param greyscale: the image in greyscale
+    :param rows: the rows of the pixels
+    :param cols: the columns of the pixels
+    :returns: the gradient magnitude of every pixel
+    """
+    height, width = greyscale.shape
+    dx = greyscale[(rows + 1) % height, cols] - greyscale[rows, cols]
+    dy = greyscale[rows, (cols + 1) % width] - greyscale[rows, cols]
+    return np.sqrt(np.power(dx, 2) + np.power(dy, 2))
 
 
 def colouring_seams(image, list_of_seams, colour):
@@ -211,6 +303,7 @@ def colouring_seams(image, list_of_seams, colour):
 def visualise_seams(image, new_shape, show_horizontal, colour=[255,0,0]):
     """
     Visualises the seams that would be removed when reshaping an image to new image (see example in notebook)
+    When the new shape is larger, the seams that would be duplicated are coloured instead.
     :param image: The original image
     :param new_shape: a (height, width) tuple which is the new shape
     :param show_horizontal: the carving scheme to be used.
@@ -218,52 +311,454 @@ def visualise_seams(image, new_shape, show_horizontal, colour=[255,0,0]):
     :returns: an image where the removed seams have been coloured.
     """
     new_height, new_width = new_shape
-    while new_height > image.shape[0] or new_width > image.shape[1]:
-        new_height = int(input("Warning! The new image size is bigger than the original image\nInsert new image height: "))
-        new_width = int(input("Insert new image width: "))    
     copy_image = image.copy()
     if (show_horizontal):
         number_of_seams = image.shape[0] - new_height
+        if number_of_seams < 0:
+            seam_order = np.rot90(get_seam_order(np.rot90(image, k=1), -number_of_seams), k=3)
+            copy_image[seam_order < -number_of_seams] = colour
+            return copy_image
         seams_to_visualise, _ = get_horizontal_seams(copy_image, number_of_seams)
     else:
         number_of_seams = image.shape[1] - new_width
+        if number_of_seams < 0:
+            seam_order = get_seam_order(image, -number_of_seams)
+            copy_image[seam_order < -number_of_seams] = colour
+            return copy_image
         seams_to_visualise, _ = get_vertical_seams(copy_image, number_of_seams)
     return colouring_seams(copy_image, seams_to_visualise, colour)
     
-def reshape_seam_carving(image, new_shape, carving_scheme):
+def reshape_seam_carving(image, new_shape, carving_scheme, pyramid_levels=0):
     """
     Resizes an image to new shape using seam carving
+    A dimension that grows is enlarged by duplicating its lowest-energy seams (see retarget_width).
     :param image: The original image
     :param new_shape: a (height, width) tuple which is the new shape
     :param carving_scheme: the carving scheme to be used.
+    :param pyramid_levels: when > 0 the seams are removed with the coarse-to-fine search of
+        get_vertical_seams_pyramid, which is faster on large images but not exact
     :returns: the image resized to new_shape
     """
-    ###Your code here###
-    ###**************###
     new_height, new_width = new_shape
-    while new_height > image.shape[0] or new_width > image.shape[1]:
-        new_height = int(input("Warning! The new image size is bigger than the original image\nInsert new image height: "))
-        new_width = int(input("Insert new image width: "))
-        
-    new_image = image.copy()    
-    number_of_horizontal_seams = image.shape[0] - new_height
-    number_of_vertical_seams = image.shape[1] - new_width
-    horizontal_seams_to_remove = []
-    vertical_seams_to_remove = []
+    new_image = image.copy()
+    # Enlarged dimensions are handled first, the rest is carved with the chosen scheme
+    if new_width > new_image.shape[1]:
+        new_image = enlarge_width(new_image, new_width)
+    if new_height > new_image.shape[0]:
+        new_image = np.rot90(enlarge_width(np.rot90(new_image, k=1), new_height), k=3)
+
+    number_of_horizontal_seams = new_image.shape[0] - new_height
+    number_of_vertical_seams = new_image.shape[1] - new_width
     
     if carving_scheme == 0:
-        _, new_image = get_vertical_seams(new_image, number_of_vertical_seams)
-        _, new_image = get_horizontal_seams(new_image, number_of_horizontal_seams)
+        _, new_image = get_vertical_seams(new_image, number_of_vertical_seams, pyramid_levels)
+        _, new_image = get_horizontal_seams(new_image, number_of_horizontal_seams, pyramid_levels)
     elif carving_scheme == 1:
-        _, new_image = get_horizontal_seams(new_image, number_of_horizontal_seams)
-        _, new_image = get_vertical_seams(new_image, number_of_vertical_seams)
+        _, new_image = get_horizontal_seams(new_image, number_of_horizontal_seams, pyramid_levels)
+        _, new_image = get_vertical_seams(new_image, number_of_vertical_seams, pyramid_levels)
     elif carving_scheme == 2:
         while number_of_horizontal_seams > 0 or number_of_vertical_seams > 0:
             if number_of_vertical_seams > 0:
-                _, new_image = get_vertical_seams(new_image, 1)
+                _, new_image = get_vertical_seams(new_image, 1, pyramid_levels)
                 number_of_vertical_seams -= 1
             if number_of_horizontal_seams > 0:
-                _, new_image = get_horizontal_seams(new_image, 1)
+                _, new_image = get_horizontal_seams(new_image, 1, pyramid_levels)
                 number_of_horizontal_seams -= 1
     
     return new_image
+
+def get_seam_order(image, max_seams=None, dtype=np.float64):
+    """
+    Removes vertical seams one after the other (as get_vertical_seams does) and records when every pixel is removed.
+    The result is an index from which the image can be retargeted to any width without running the DP again.
+    :param image: The original image
+    :param max_seams: the number of seams to record, by default all of them (width - 1)
+    :param dtype: the type of the energy maps and the cost matrix (np.float64 or np.float32)
+    :returns: an int32 array of the image height and width, holding the number of the seam that removes every
+        pixel, pixels that are never removed hold max_seams
+    """
+    height, width = image.shape[:2]
+    max_seams = width - 1 if max_seams is None else min(max_seams, width - 1)
+    seam_order = np.full((height, width), max_seams, dtype=np.int32)
+    # The original column of every pixel that is still in the image
+    columns = np.tile(np.arange(width), (height, 1))
+    M, backtrack = np.empty((height, width), dtype=dtype), np.empty((height, width), dtype=int)
+    greyscale = get_greyscale_image(image, greyscale_wt, dtype=dtype, scratch=M)
+    energy_map = gradient_magnitude(image, greyscale_wt, dtype=dtype, greyscale_out=M)
+    for i in range(max_seams):
+        current = greyscale.shape[1]
+        forward_energy(energy_map, greyscale, out=M[:, :current], backtrack_out=backtrack[:, :current])
+        seam = find_seam(M[:, :current], backtrack[:, :current])
+        rows, cols = np.array(seam).T
+        seam_order[rows, columns[rows, cols]] = i
+        columns = remove_seam_in_place(columns, seam_columns(seam))
+        greyscale, energy_map = remove_seam_from_maps(greyscale, energy_map, seam)
+    return seam_order
+
+def retarget_width(image, seam_order, new_width):
+    """
+    Resizes an image to a new width with its seam order index
+    A smaller width keeps the pixels that outlive the first (width - new_width) seams, which is the result of
+    get_vertical_seams. A larger width duplicates the pixels of the first (new_width - width) seams.
+    :param image: The original image
+    :param seam_order: the index of the image from get_seam_order
+    :param new_width: the new width
+    :returns: the image resized to new_width
+    """
+    height, width = seam_order.shape
+    recorded = int(seam_order.max()) if seam_order.size else 0
+    seams = abs(new_width - width)
+    # A full index (width - 1 seams) can also double the image, every pixel is then duplicated
+    available = width if recorded == width - 1 and new_width > width else recorded
+    if seams > available:
+        raise ValueError('the seam order index holds {} seams, {} are needed'.format(recorded, seams))
+    if new_width <= width:
+        return image[seam_order >= seams].reshape(height, new_width, *image.shape[2:])
+    counts = 1 + (seam_order < seams)
+    return np.repeat(image.reshape(height * width, *image.shape[2:]), counts.ravel(), axis=0).reshape(
+        height, new_width, *image.shape[2:])
+
+def enlarge_width(image, new_width):
+    """
+    Enlarges an image to a new width by duplicating its lowest-energy seams, an image can grow by at most its width
+    at a time so larger factors are done in steps
+    :param image: The original image
+    :param new_width: the new width
+    :returns: the image resized to new_width
+    """
+    while image.shape[1] < new_width:
+        seams = min(new_width - image.shape[1], image.shape[1])
+        image = retarget_width(image, get_seam_order(image, seams), image.shape[1] + seams)
+    return image
+
+
+# Coarse-to-fine seam carving for large images.
+# Every seam is first found on a downsampled level of the greyscale and energy maps, and then refined at full
+# resolution by a dynamic programming pass restricted to a narrow band around the coarse seam.
+
+def area_downsample(image, factor):
+    """
+    Shrinks a 2D map by averaging blocks of factor x factor pixels
+    :param image: a (height, width) array
+    :param factor: the size of the blocks, the last row and column are repeated to fill the last blocks
+    :returns: an array of ceil(height / factor) by ceil(width / factor)
+    """
+    height, width = image.shape
+    padded = np.pad(image, ((0, -height % factor), (0, -width % factor)), mode='edge')
+    return padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor).mean(axis=(1, 3))
+
+def forward_energy_band(energy_map, image, lo, band):
+    """
+    forward_energy restricted to the columns lo[row] .. lo[row] + band - 1 of every row, the cost of columns
+    outside of the band is infinite. With lo = 0 and band = width it is the same as forward_energy.
+    :param energy_map: the gradient magnitude of the image
+    :param image: the image in greyscale
+    :param lo: the first column of the band in every row, neighbouring rows may differ by at most one
+    :param band: the width of the band
+    :returns: the cost matrix M of the band and its backtrack matrix, which holds columns of the image
+    """
+    height, width = energy_map.shape
+    rows = np.arange(height)[:, None]
+    cols = lo[:, None] + np.arange(band)
+    left_cols = np.maximum(cols - 1, 0)
+    right_cols = np.minimum(cols + 1, width - 1)
+    M = energy_map[rows, cols].astype(np.float64)
+    # The edge costs do not depend on M, so they are gathered for all the rows at once
+    up, current = image[rows - 1, cols], image[rows, cols]
+    middle = np.where((cols > 0) & (cols < width - 1), np.abs(image[rows, right_cols] - image[rows, left_cols]), 0)
+    left_cost = middle + np.abs(up - image[rows, left_cols])
+    right_cost = middle + np.abs(image[rows, right_cols] - up)
+    # The previous row is padded with two inf on each side, so the columns c - 1, c and c + 1 of a band that
+    # moved by one column are plain slices of it
+    prev = np.full((height, band + 4), np.inf)
+    starts = np.concatenate(([1], lo[1:] - lo[:-1] + 1))
+    for row in range(1, height):
+        prev[row - 1, 2:-2] = M[row - 1]
+        start = starts[row]
+        M[row] += np.minimum(np.minimum(prev[row - 1, start:start + band] + left_cost[row],
+                                        prev[row - 1, start + 1:start + band + 1] + middle[row]),
+                             prev[row - 1, start + 2:start + band + 2] + right_cost[row])
+
+    # Back pointers to the lowest of the (up to) three pixels above, the leftmost one on ties
+    positions = starts[:, None] + np.arange(band)
+    prev_left = np.take_along_axis(np.roll(prev, 1, axis=0), positions, axis=1)
+    prev_up = np.take_along_axis(np.roll(prev, 1, axis=0), positions + 1, axis=1)
+    prev_right = np.take_along_axis(np.roll(prev, 1, axis=0), positions + 2, axis=1)
+    go_left = (prev_left <= prev_up) & (prev_left <= prev_right)
+    go_up = ~go_left & (prev_up <= prev_right)
+    backtrack = cols + np.where(go_left, -1, np.where(go_up, 0, 1))
+    backtrack[0] = 0
+    return M, backtrack
+
+def find_seam_band(M, backtrack, lo):
+    col = lo[-1] + np.argmin(M[-1])
+    seam = []
+    for row in reversed(range(M.shape[0])):
+        seam.append([row, col])
+        col = backtrack[row, col - lo[row]]
+    return seam
+
+def get_vertical_seams_pyramid(image, seams_number, levels=2, window=None, dtype=np.float64):
+    """
+    Removes vertical seams like get_vertical_seams, but finds every seam coarse-to-fine: the dynamic programming
+    runs on the maps downsampled by 2 ** levels, and the coarse seam is then refined at full resolution within
+    window columns to each side of it. This is faster on large images, the seams found are close to the exact
+    ones but not always the same (see seam_carving_quality).
+    :param image: The original image
+    :param seams_number: the number of seams to remove
+    :param levels: the number of pyramid levels, each one halves the size of the maps
+    :param window: how many columns the seam may move away from the coarse one at full resolution,
+        4 * 2 ** levels by default
+    :param dtype: the type of the energy maps (np.float64 or np.float32)
+    :returns: the list of seams and the image without them
+    """
+    factor = 2 ** levels
+    window = 4 * factor if window is None else window
+    vertical_seams_list = []
+    image = np.array(image)
+    greyscale = get_greyscale_image(image, greyscale_wt, dtype=dtype)
+    energy_map = gradient_magnitude(image, greyscale_wt, dtype=dtype)
+    height = greyscale.shape[0]
+    rows = np.arange(height)
+    coarse_rows = np.arange(-(-height // factor)) * factor + (factor - 1) / 2
+    for i in range(seams_number):
+        width = greyscale.shape[1]
+        # Removing factor seams takes about one column off the coarse level, so it is only rebuilt that often and
+        # the seams in between are refined around the same coarse seam
+        if i % factor == 0:
+            M, backtrack = forward_energy(area_downsample(energy_map, factor), area_downsample(greyscale, factor))
+            coarse_seam = np.array(find_seam(M, backtrack))[::-1]
+            # The centres of the coarse seam are joined by straight lines, which move at most one column per row
+            centre = np.interp(rows, coarse_rows, np.minimum(coarse_seam[:, 1] * factor + (factor - 1) / 2, width - 1))
+        band = min(2 * window + 1, width)
+        lo = np.clip(np.floor(centre + 0.5).astype(int) - window, 0, width - band)
+        M, backtrack = forward_energy_band(energy_map, greyscale, lo, band)
+        vertical_seams_list.append(find_seam_band(M, backtrack, lo))
+        image = remove_seam_in_place(image, seam_columns(vertical_seams_list[i]))
+        greyscale, energy_map = remove_seam_from_maps(greyscale, energy_map, vertical_seams_list[i])
+    return vertical_seams_list, image
+
+def seams_to_mask(shape, list_of_seams):
+    """
+    Marks the pixels of the original image that a list of seams removes, each seam is given in the columns of
+    the image that is left after the seams before it were removed
+    :param shape: the (height, width) of the original image
+    :param list_of_seams: the seams as returned by get_vertical_seams
+    :returns: a boolean mask of the removed pixels
+    """
+    height, width = shape
+    mask = np.zeros(shape, dtype=bool)
+    columns = np.tile(np.arange(width), (height, 1))
+    for seam in list_of_seams:
+        rows, cols = np.array(seam).T
+        mask[rows, columns[rows, cols]] = True
+        keep = np.ones(columns.shape, dtype=bool)
+        keep[rows, cols] = False
+        columns = columns[keep].reshape(height, -1)
+    return mask
+
+def seam_carving_quality(image, seams_number, levels=2, window=None):
+    """
+    Compares the coarse-to-fine seams with the exact ones on an image
+    :param image: The original image
+    :param seams_number: the number of vertical seams to remove
+    :param levels: the pyramid levels of get_vertical_seams_pyramid
+    :param window: the refinement window of get_vertical_seams_pyramid
+    :returns: a dict with the energy of the pixels removed by both (measured on the energy map of the original
+        image), the relative energy loss of the pyramid seams, the fraction of removed pixels both agree on, the
+        mean difference between the two results (0 to 1) and the time each one took
+    """
+    energy_map = gradient_magnitude(image, greyscale_wt)
+    start = time.perf_counter()
+    exact_seams, exact_image = get_vertical_seams(image, seams_number)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pyramid_seams, pyramid_image = get_vertical_seams_pyramid(image, seams_number, levels, window)
+    pyramid_time = time.perf_counter() - start
+    exact_mask = seams_to_mask(energy_map.shape, exact_seams)
+    pyramid_mask = seams_to_mask(energy_map.shape, pyramid_seams)
+    exact_energy = float(np.sum(energy_map[exact_mask]))
+    pyramid_energy = float(np.sum(energy_map[pyramid_mask]))
+    return {
+        'exact_energy': exact_energy,
+        'pyramid_energy': pyramid_energy,
+        'energy_loss': (pyramid_energy - exact_energy) / exact_energy if exact_energy else 0.0,
+        'pixel_agreement': float(np.sum(exact_mask & pyramid_mask) / max(np.sum(exact_mask), 1)),
+        'image_difference': float(np.mean(np.abs(exact_image.astype(np.float64) - pyramid_image)) / 255),
+        'exact_time': exact_time,
+        'pyramid_time': pyramid_time,
+    }
+
+
+# Batch resizing of many images (or video frames)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def read_image(path):
+    """
+    Reads an image from path as an RGB uint8 array, float images (png) are scaled from [0, 1] and alpha is dropped
+    :param path: The path to the image
+    :returns: The image as numpy array
+    """
+    image = mpimg.imread(path)
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=2)
+    if image.dtype.kind == 'f':
+        image = (np.clip(image, 0, 1) * 255).round().astype(np.uint8)
+    return image[:, :, :3]
+
+def resize_image(image, new_shape, method='bilinear', carving_scheme=0, pyramid_levels=0):
+    """
+    Resizes an image with one of the methods of this exercise
+    :param image: The original image
+    :param new_shape: a (height, width) tuple which is the new shape
+    :param method: 'bilinear' or 'seam_carving'
+    :param carving_scheme: the carving scheme to be used with seam carving
+    :param pyramid_levels: the pyramid levels of the coarse-to-fine seam search, 0 for exact seam carving
+    :returns: the image resized to new_shape
+    """
+    if method == 'bilinear':
+        return reshape_bilinear(image, new_shape)
+    if method == 'seam_carving':
+        return reshape_seam_carving(image, new_shape, carving_scheme, pyramid_levels)
+    raise ValueError('unknown resize method: ' + str(method))
+
+def prefetch(items, size):
+    """
+    Reads the items of an iterable on a background thread into a bounded queue, so that reading the next images
+    overlaps with processing the current ones while at most size of them are held in memory
+    :param items: an iterable, for example a generator that reads images from disk
+    :param size: the maximal number of items read ahead
+    :returns: a generator of the items, in order
+    """
+    q = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                q.put((item, None))
+        except Exception as e:
+            q.put((None, e))
+        q.put((done, None))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # The consumer may stop early, the reader is told to stop and the queue is drained so it is not blocked on it
+        stop.set()
+        while thread.is_alive():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+def is_picklable(obj):
+    """
+    Checks that obj can be sent to a worker process. Functions are pickled by reference, which fails when this file
+    is loaded from its path under a module name that does not resolve to it (the hw1/ex1 package shadows ex1.py)
+    :param obj: the object to check
+    :returns: True if obj survives a pickle round trip
+    """
+    try:
+        pickle.loads(pickle.dumps(obj))
+        return True
+    except (pickle.PicklingError, AttributeError, ImportError, TypeError):
+        return False
+
+def resize_frames(frames, new_shape, method='bilinear', carving_scheme=0, workers=None, prefetch_size=8,
+                  pyramid_levels=0):
+    """
+    Resizes a stream of images (or decoded video frames) on a pool of worker processes
+    :param frames: an iterable of images
+    :param new_shape: a (height, width) tuple which is the new shape
+    :param method: 'bilinear' or 'seam_carving'
+    :param carving_scheme: the carving scheme to be used with seam carving
+    :param workers: the number of worker processes, None for all the cores and 0 to resize in this process.
+        When resize_image cannot be pickled (see is_picklable) None falls back to this process with a warning
+        and an explicit number of workers raises a RuntimeError
+    :param prefetch_size: the number of frames read ahead and the number of frames in flight in the pool
+    :param pyramid_levels: the pyramid levels of the coarse-to-fine seam search, 0 for exact seam carving
+    :returns: a generator of the resized frames, in the order of frames
+    """
+    resize = partial(resize_image, new_shape=new_shape, method=method, carving_scheme=carving_scheme,
+                     pyramid_levels=pyramid_levels)
+    if workers != 0 and not is_picklable(resize):
+        message = 'resize_image cannot be sent to worker processes, import ex1 as a module to resize in parallel'
+        if workers is not None:
+            raise RuntimeError('{} (workers={})'.format(message, workers))
+        warnings.warn(message + ', the frames are resized in this process', RuntimeWarning)
+        workers = 0
+    frames = prefetch(frames, prefetch_size)
+    try:
+        if workers == 0:
+            for frame in frames:
+                yield resize(frame)
+            return
+        pool = ProcessPoolExecutor(workers)
+        pending = deque()
+        try:
+            for frame in frames:
+                pending.append(pool.submit(resize, frame))
+                if len(pending) >= prefetch_size:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(cancel_futures=True)
+    finally:
+        frames.close()
+
+def resize_directory(input_dir, output_dir, new_shape, method='bilinear', carving_scheme=0, workers=None,
+                     prefetch_size=8, pyramid_levels=0):
+    """
+    Resizes every image of a directory and writes the results, under the same names, to another directory
+    :param input_dir: the directory of the original images
+    :param output_dir: the directory the resized images are written to (created if needed)
+    :param new_shape: a (height, width) tuple which is the new shape
+    :param method: 'bilinear' or 'seam_carving'
+    :param carving_scheme: the carving scheme to be used with seam carving
+    :param workers: the number of worker processes, None for all the cores and 0 to resize in this process
+    :param prefetch_size: the number of images read ahead and the number of images in flight in the pool
+    :param pyramid_levels: the pyramid levels of the coarse-to-fine seam search, 0 for exact seam carving
+    :returns: the names of the resized images
+    """
+    names = sorted(name for name in os.listdir(input_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    os.makedirs(output_dir, exist_ok=True)
+    images = (read_image(os.path.join(input_dir, name)) for name in names)
+    resized = resize_frames(images, new_shape, method, carving_scheme, workers, prefetch_size, pyramid_levels)
+    for name, image in zip(names, resized):
+        plt.imsave(os.path.join(output_dir, name), image)
+    return names
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Resize every image of a directory on a pool of worker processes.')
+    parser.add_argument('input_dir', help='the directory of the original images')
+    parser.add_argument('output_dir', help='the directory the resized images are written to')
+    parser.add_argument('height', type=int)
+    parser.add_argument('width', type=int)
+    parser.add_argument('--method', choices=['bilinear', 'seam_carving'], default='bilinear')
+    parser.add_argument('--carving-scheme', type=int, default=0, help='the carving scheme of seam carving')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of worker processes, all the cores by default and 0 to resize in this process')
+    parser.add_argument('--prefetch', type=int, default=8, help='the number of images read ahead')
+    parser.add_argument('--pyramid-levels', type=int, default=0,
+                        help='find the seams coarse-to-fine on this many pyramid levels, 0 for exact seam carving')
+    args = parser.parse_args()
+    start = time.time()
+    names = resize_directory(args.input_dir, args.output_dir, (args.height, args.width), args.method,
+                             args.carving_scheme, args.workers, args.prefetch, args.pyramid_levels)
+    print('resized {} images in {:.2f}s'.format(len(names), time.time() - start))
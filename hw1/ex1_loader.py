@@ -0,0 +1,13 @@
+# Pre-requirments
+import importlib.util
+import os
+
+EX1_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ex1.py')
+
+
+# hw1/ex1.py is loaded from its path, the hw1/ex1 package of the exercise template has the same name
+def load_ex1():
+    spec = importlib.util.spec_from_file_location('ex1', EX1_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
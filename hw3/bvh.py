@@ -0,0 +1,343 @@
+# Pre-requirments
+import copy
+import time
+import numpy as np
+import render_stats
+
+
+# This function gets (N, 3) arrays of box corners and returns the surface area of every box
+def box_area(box_min, box_max):
+    d = box_max - box_min
+    return 2 * (d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0])
+
+
+# Bounding volume hierarchy over a list of primitives given by their bounding boxes.
+# The tree is built once with the surface area heuristic (SAH) and flattened into arrays:
+# node i has the box node_min[i], node_max[i]. Inner nodes point to their children with node_left and node_right,
+# leaves hold the primitives prim_order[node_first[i]:node_first[i] + node_size[i]].
+class BVH:
+    # The arrays that make up a built BVH, see to_arrays and from_arrays
+    ARRAYS = ('bounds_min', 'bounds_max', 'node_min', 'node_max', 'node_left', 'node_right', 'node_axis', 'node_first',
+              'node_size', 'prim_order')
+
+    def __init__(self, bounds_min, bounds_max, leaf_size=4, bins=12):
+        start = time.perf_counter()
+        self.bounds_min = np.array(bounds_min, dtype=np.float64).reshape(-1, 3)
+        self.bounds_max = np.array(bounds_max, dtype=np.float64).reshape(-1, 3)
+        self.leaf_size = leaf_size
+        self.bins = bins
+        self.build()
+        self.build_time = time.perf_counter() - start
+
+    def __repr__(self):
+        return 'BVH(primitives={}, nodes={}, leaves={}, build_time={:.3f}s)'.format(
+            len(self.prim_order), self.node_count, int(np.sum(self.node_left < 0)), self.build_time)
+
+    # A BVH made of arrays saved by to_arrays, nothing is built and the arrays are used as given (memory maps too)
+    @classmethod
+    def from_arrays(cls, arrays, leaf_size=4, bins=12):
+        bvh = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(bvh, name, arrays[name])
+        bvh.leaf_size = leaf_size
+        bvh.bins = bins
+        bvh.build_time = 0.0
+        return bvh
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    # A copy of the BVH with its boxes in another precision (np.float32), rounded outwards so they still hold
+    # their primitives
+    def astype(self, dtype):
+        bvh = copy.copy(self)
+        for name, towards in (('bounds_min', -np.inf), ('bounds_max', np.inf), ('node_min', -np.inf),
+                              ('node_max', np.inf)):
+            setattr(bvh, name, np.nextafter(getattr(self, name).astype(dtype), np.asarray(towards, dtype=dtype)))
+        return bvh
+
+    # A copy of the BVH with the same tree over primitives that moved to new bounding boxes, only the boxes of the
+    # nodes are computed again, bottom up. The tree gets worse as the primitives move away from where it was built,
+    # see traversal_cost.
+    def refit(self, bounds_min, bounds_max):
+        bvh = copy.copy(self)
+        bvh.bounds_min = np.array(bounds_min, dtype=np.float64).reshape(-1, 3)
+        bvh.bounds_max = np.array(bounds_max, dtype=np.float64).reshape(-1, 3)
+        box_min, box_max = np.empty(self.node_min.shape), np.empty(self.node_max.shape)
+        # The leaves cover prim_order in consecutive ranges
+        leaves = np.flatnonzero(self.node_left < 0)
+        leaves = leaves[np.argsort(self.node_first[leaves])]
+        if len(leaves):
+            box_min[leaves] = np.minimum.reduceat(bvh.bounds_min[self.prim_order], self.node_first[leaves])
+            box_max[leaves] = np.maximum.reduceat(bvh.bounds_max[self.prim_order], self.node_first[leaves])
+        for level in reversed(self.get_levels()):
+            inner = level[self.node_left[level] >= 0]
+            left, right = self.node_left[inner], self.node_right[inner]
+            box_min[inner] = np.minimum(box_min[left], box_min[right])
+            box_max[inner] = np.maximum(box_max[left], box_max[right])
+        # The same padding as build
+        pad = 1e-9 * (1 + np.maximum(np.abs(box_min), np.abs(box_max)))
+        bvh.node_min, bvh.node_max = box_min - pad, box_max + pad
+        return bvh
+
+    # The nodes of the tree by depth, a list of arrays starting with the root
+    def get_levels(self):
+        levels = []
+        level = np.zeros(1 if self.node_count else 0, dtype=int)
+        while len(level):
+            levels.append(level)
+            inner = level[self.node_left[level] >= 0]
+            level = np.concatenate([self.node_left[inner], self.node_right[inner]])
+        return levels
+
+    # The surface area heuristic cost of the tree: the expected number of box and primitive tests of a ray that
+    # hits the root box, up to constants
+    def traversal_cost(self):
+        if not self.node_count:
+            return 0.0
+        area = box_area(self.node_min, self.node_max)
+        leaves = self.node_left < 0
+        return float((area[~leaves].sum() + (area[leaves] * self.node_size[leaves]).sum()) / max(area[0], 1e-300))
+
+    @property
+    def node_count(self):
+        return len(self.node_min)
+
+    def build(self):
+        centroids = (self.bounds_min + self.bounds_max) / 2
+        self.prim_order = np.arange(len(centroids))
+        node_min, node_max, node_left, node_right, node_axis, node_first, node_size = [], [], [], [], [], [], []
+
+        def new_node(first, size):
+            prims = self.prim_order[first:first + size]
+            box_min, box_max = self.bounds_min[prims].min(axis=0), self.bounds_max[prims].max(axis=0)
+            # Pad the box a little so hits exactly on a primitive border are not lost to rounding
+            pad = 1e-9 * (1 + np.maximum(np.abs(box_min), np.abs(box_max)))
+            node_min.append(box_min - pad)
+            node_max.append(box_max + pad)
+            node_left.append(-1)
+            node_right.append(-1)
+            node_axis.append(0)
+            node_first.append(first)
+            node_size.append(size)
+            return len(node_min) - 1
+
+        stack = [new_node(0, len(centroids))] if len(centroids) else []
+        while stack:
+            node = stack.pop()
+            first, size = node_first[node], node_size[node]
+            prims = self.prim_order[first:first + size]
+            axis, left_mask = None, None
+            if size > self.leaf_size:
+                axis, left_mask = self.find_split(prims, centroids[prims])
+            if axis is None:
+                # The primitives of a leaf are kept sorted, so the first of equally near hits has the lowest index
+                prims.sort()
+                continue
+            self.prim_order[first:first + size] = np.concatenate([prims[left_mask], prims[~left_mask]])
+            left_size = int(np.sum(left_mask))
+            node_axis[node] = axis
+            node_left[node] = new_node(first, left_size)
+            node_right[node] = new_node(first + left_size, size - left_size)
+            stack += [node_right[node], node_left[node]]
+
+        self.node_min = np.array(node_min).reshape(-1, 3)
+        self.node_max = np.array(node_max).reshape(-1, 3)
+        self.node_left = np.array(node_left, dtype=int)
+        self.node_right = np.array(node_right, dtype=int)
+        self.node_axis = np.array(node_axis, dtype=int)
+        self.node_first = np.array(node_first, dtype=int)
+        self.node_size = np.array(node_size, dtype=int)
+
+    # Binned SAH: the centroids are put into bins along every axis and the split between bins with the lowest
+    # (area * primitive count) of both sides is chosen. Returns the split axis and a mask of the left primitives.
+    def find_split(self, prims, centroids):
+        c_min, c_max = centroids.min(axis=0), centroids.max(axis=0)
+        extent = c_max - c_min
+        best_cost, best_axis, best_mask = np.inf, None, None
+        for axis in range(3):
+            if extent[axis] <= 0:
+                continue
+            bin_of = np.minimum(((centroids[:, axis] - c_min[axis]) / extent[axis] * self.bins).astype(int),
+                                self.bins - 1)
+            counts = np.bincount(bin_of, minlength=self.bins)
+            bin_min = np.full((self.bins, 3), np.inf)
+            bin_max = np.full((self.bins, 3), -np.inf)
+            np.minimum.at(bin_min, bin_of, self.bounds_min[prims])
+            np.maximum.at(bin_max, bin_of, self.bounds_max[prims])
+            left_count = np.cumsum(counts)[:-1]
+            right_count = len(prims) - left_count
+            with np.errstate(invalid='ignore'):
+                left_area = box_area(np.minimum.accumulate(bin_min)[:-1], np.maximum.accumulate(bin_max)[:-1])
+                right_area = box_area(np.minimum.accumulate(bin_min[::-1])[::-1][1:],
+                                      np.maximum.accumulate(bin_max[::-1])[::-1][1:])
+                cost = left_area * left_count + right_area * right_count
+            cost[(left_count == 0) | (right_count == 0)] = np.inf
+            split = int(np.argmin(cost))
+            if cost[split] < best_cost:
+                best_cost, best_axis, best_mask = cost[split], axis, bin_of <= split
+        return best_axis, best_mask
+
+    def is_leaf(self, node):
+        return self.node_left[node] < 0
+
+    # Slab test of one ray against the box of a node, returns the entry distance or np.inf for a miss
+    def enter_distance(self, node, origin, inv_direction):
+        with np.errstate(invalid='ignore'):
+            t1 = (self.node_min[node] - origin) * inv_direction
+            t2 = (self.node_max[node] - origin) * inv_direction
+        t_near = max(np.max(np.fmin(t1, t2)), 0)
+        t_far = np.min(np.fmax(t1, t2))
+        return t_near if t_near <= t_far else np.inf
+
+    # Slab test of N rays given as (N, 3) arrays against the box of a node
+    def enter_distances(self, node, origins, inv_directions):
+        with np.errstate(invalid='ignore'):
+            t1 = (self.node_min[node] - origins) * inv_directions
+            t2 = (self.node_max[node] - origins) * inv_directions
+        t_near = np.maximum(np.max(np.fmin(t1, t2), axis=1), 0)
+        t_far = np.min(np.fmax(t1, t2), axis=1)
+        return np.where(t_near <= t_far, t_near, np.inf)
+
+    # Returns the children of a node, the one that the direction points to first
+    def ordered_children(self, node, direction_sign):
+        if direction_sign >= 0:
+            return self.node_left[node], self.node_right[node]
+        return self.node_right[node], self.node_left[node]
+
+    # Finds the nearest primitive along one ray.
+    # intersect_prims(prims) gets the array of primitives of a leaf and returns (distances, payloads) for them,
+    # with np.inf as the distance of a miss.
+    # Returns the distance, the primitive index (-1 for a miss) and its payload.
+    # Ties are broken towards the lower primitive index, as a linear scan would.
+    def nearest(self, origin, direction, intersect_prims):
+        with np.errstate(divide='ignore'):
+            inv_direction = 1 / np.asarray(direction, dtype=np.float64)
+        best_t, best_prim, best_payload = np.inf, -1, None
+        stack = [0] if self.node_count else []
+        stats = render_stats.active
+        while stack:
+            node = stack.pop()
+            if stats is not None:
+                stats.count_tests('BVHNode', 1)
+            enter = self.enter_distance(node, origin, inv_direction)
+            if enter == np.inf or enter > best_t:
+                continue
+            if self.is_leaf(node):
+                first = self.node_first[node]
+                prims = self.prim_order[first:first + self.node_size[node]]
+                t, payload = intersect_prims(prims)
+                k = int(np.argmin(t))
+                if t[k] < best_t or (t[k] == best_t and t[k] < np.inf and prims[k] < best_prim):
+                    best_t, best_prim, best_payload = t[k], prims[k], payload[k]
+            else:
+                near, far = self.ordered_children(node, direction[self.node_axis[node]])
+                stack += [far, near]
+        return best_t, best_prim, best_payload
+
+    # Packet version of nearest for N rays given as (N, 3) arrays.
+    # intersect_prims(prims, origins, directions) returns (distances, payloads) arrays of shape (primitives, rays)
+    # for the given subset of rays.
+    # The packet is traversed together, rays that miss a node are dropped from the packet below it.
+    def nearest_batch(self, origins, directions, intersect_prims):
+        n = len(origins)
+        with np.errstate(divide='ignore'):
+            inv_directions = 1 / directions
+        best_t = np.full(n, np.inf, dtype=origins.dtype)
+        best_prim = np.full(n, -1)
+        best_payload = np.zeros(n, dtype=int)
+        stack = [(0, np.arange(n))] if self.node_count and n else []
+        stats = render_stats.active
+        while stack:
+            node, rays = stack.pop()
+            if stats is not None:
+                stats.count_tests('BVHNode', len(rays), rays=rays)
+            enter = self.enter_distances(node, origins[rays], inv_directions[rays])
+            rays = rays[(enter < np.inf) & (enter <= best_t[rays])]
+            if not len(rays):
+                continue
+            if self.is_leaf(node):
+                first = self.node_first[node]
+                prims = self.prim_order[first:first + self.node_size[node]]
+                if stats is not None:
+                    stats.push_rays(rays)
+                t, payload = intersect_prims(prims, origins[rays], directions[rays])
+                if stats is not None:
+                    stats.pop_rays()
+                k = np.argmin(t, axis=0)
+                columns = np.arange(len(rays))
+                t, payload, prim = t[k, columns], payload[k, columns], prims[k]
+                current = best_t[rays]
+                closer = (t < current) | ((t == current) & (t < np.inf) & (prim < best_prim[rays]))
+                hit_rays = rays[closer]
+                best_t[hit_rays] = t[closer]
+                best_prim[hit_rays] = prim[closer]
+                best_payload[hit_rays] = payload[closer]
+            else:
+                sign = np.sum(np.sign(directions[rays, self.node_axis[node]]))
+                near, far = self.ordered_children(node, sign)
+                stack += [(far, rays), (near, rays)]
+        return best_t, best_prim, best_payload
+
+    # Any-hit query along one ray, the traversal stops at the first primitive that blocks the ray before
+    # max_distance. blocks_prims(prims) returns a boolean array telling which primitives of a leaf block the ray.
+    # Returns the blocking primitive, -1 if there is none.
+    def any_hit(self, origin, direction, max_distance, blocks_prims):
+        with np.errstate(divide='ignore'):
+            inv_direction = 1 / np.asarray(direction, dtype=np.float64)
+        stack = [0] if self.node_count else []
+        stats = render_stats.active
+        while stack:
+            node = stack.pop()
+            if stats is not None:
+                stats.count_tests('BVHNode', 1)
+            enter = self.enter_distance(node, origin, inv_direction)
+            if enter == np.inf or enter > max_distance:
+                continue
+            if self.is_leaf(node):
+                first = self.node_first[node]
+                prims = self.prim_order[first:first + self.node_size[node]]
+                blocked = np.flatnonzero(blocks_prims(prims))
+                if len(blocked):
+                    return prims[blocked[0]]
+            else:
+                near, far = self.ordered_children(node, direction[self.node_axis[node]])
+                stack += [far, near]
+        return -1
+
+    # Packet version of any_hit, max_distances is an (N,) array.
+    # blocks_prims(prims, origins, directions, max_distances) returns a (primitives, rays) boolean array.
+    # Rays are dropped from the packet as soon as they are blocked.
+    def any_hit_batch(self, origins, directions, max_distances, blocks_prims):
+        n = len(origins)
+        with np.errstate(divide='ignore'):
+            inv_directions = 1 / directions
+        blocker = np.full(n, -1)
+        stack = [(0, np.arange(n))] if self.node_count and n else []
+        stats = render_stats.active
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[blocker[rays] < 0]
+            if not len(rays):
+                continue
+            if stats is not None:
+                stats.count_tests('BVHNode', len(rays), rays=rays)
+            enter = self.enter_distances(node, origins[rays], inv_directions[rays])
+            rays = rays[(enter < np.inf) & (enter <= max_distances[rays])]
+            if not len(rays):
+                continue
+            if self.is_leaf(node):
+                first = self.node_first[node]
+                prims = self.prim_order[first:first + self.node_size[node]]
+                if stats is not None:
+                    stats.push_rays(rays)
+                blocked = blocks_prims(prims, origins[rays], directions[rays], max_distances[rays])
+                if stats is not None:
+                    stats.pop_rays()
+                any_blocked = blocked.any(axis=0)
+                blocker[rays[any_blocked]] = prims[np.argmax(blocked[:, any_blocked], axis=0)]
+            else:
+                sign = np.sum(np.sign(directions[rays, self.node_axis[node]]))
+                near, far = self.ordered_children(node, sign)
+                stack += [(far, rays), (near, rays)]
+        return blocker
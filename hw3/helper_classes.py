@@ -1,5 +1,8 @@
 # Pre-requirments
+import copy
 import numpy as np
+import render_stats
+from bvh import BVH
 
 
 # This function gets a vector and returns its normalized form.
@@ -14,11 +17,62 @@ def reflected(vector, normal):
     return v
 
 
+# Batched versions of the helpers above, they work on (N, 3) arrays holding one vector per row.
+def normalize_rows(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# This function returns the dot product of every pair of rows
+def dot_rows(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+
+def reflected_rows(vectors, normals):
+    return normalize_rows(vectors - 2 * dot_rows(vectors, normals)[:, None] * normals)
+
+
+# This function tells which hit distances block a shadow ray, misses (np.inf) never block even a directional light
+def blocks(t, max_distance):
+    return (t < np.inf) & (t <= max_distance)
+
+
+# The distance hit points are moved along their normal, so the shadow and reflected rays that leave them do not hit
+# their own surface. float64 uses the 1e-10 of get_current_color. A float32 hit point is only known to a few units in
+# the last place of its largest coordinate, so there the offset is a multiple of eps that grows with the coordinates.
+def surface_offset(points):
+    if points.dtype == np.float64:
+        return 1e-10
+    scale = np.maximum(1, np.abs(points).max(axis=1))[:, None]
+    return 32 * np.finfo(points.dtype).eps * scale
+
+
+# This function returns a shallow copy of obj with its floating point array attributes converted to dtype
+def cast_arrays(obj, dtype):
+    cast = copy.copy(obj)
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.floating):
+            setattr(cast, name, value.astype(dtype))
+    return cast
+
+
+# This function applies a 4x4 affine transform to a point or to an (N, 3) array of points
+def transform_points(transform, points):
+    return points @ transform[:3, :3].T + transform[:3, 3]
+
+
 # Lights
 class LightSource:
     def __init__(self, intensity):
         self.intensity = np.array(intensity)
 
+    # A copy of the light for the batched methods in another precision (np.float32)
+    def astype(self, dtype):
+        light = copy.copy(self)
+        for name in ('intensity', 'position', 'direction'):
+            if hasattr(self, name):
+                setattr(light, name, np.asarray(getattr(self, name), dtype=dtype))
+        return light
+
 
 class DirectionalLight(LightSource):
     def __init__(self, intensity, direction):
@@ -27,7 +81,7 @@ class DirectionalLight(LightSource):
 
     # This function returns the ray that goes from the light source to a point
     def get_light_ray(self, intersection_point):
-        return Ray(intersection_point, self.direction)
+        return Ray(intersection_point, self.direction, normalized=True)
 
     # This function returns the distance from a point to the light source
     def get_distance_from_light(self, intersection):
@@ -37,6 +91,16 @@ class DirectionalLight(LightSource):
     def get_intensity(self, intersection):
         return self.intensity
 
+    # Batched versions, they get an (N, 3) array of points
+    def get_light_directions(self, points):
+        return np.broadcast_to(self.direction, points.shape)
+
+    def get_distances_from_light(self, points):
+        return np.full(len(points), np.inf, dtype=points.dtype)
+
+    def get_intensities(self, points):
+        return np.broadcast_to(self.intensity, points.shape)
+
 
 class PointLight(LightSource):
     def __init__(self, intensity, position, kc, kl, kq):
@@ -48,7 +112,7 @@ class PointLight(LightSource):
 
     # This function returns the ray that goes from the light source to a point
     def get_light_ray(self, intersection):
-        return Ray(intersection, normalize(self.position - intersection))
+        return Ray(intersection, normalize(self.position - intersection), normalized=True)
 
     # This function returns the distance from a point to the light source
     def get_distance_from_light(self, intersection):
@@ -59,6 +123,17 @@ class PointLight(LightSource):
         d = self.get_distance_from_light(intersection)
         return self.intensity / (self.kc + self.kl * d + self.kq * np.power(d, 2))
 
+    # Batched versions, they get an (N, 3) array of points
+    def get_light_directions(self, points):
+        return normalize_rows(self.position - points)
+
+    def get_distances_from_light(self, points):
+        return np.linalg.norm(points - self.position, axis=1)
+
+    def get_intensities(self, points):
+        d = self.get_distances_from_light(points)
+        return self.intensity / (self.kc + self.kl * d + self.kq * np.power(d, 2))[:, None]
+
 
 class SpotLight(LightSource):
     def __init__(self, intensity, position, direction, kc, kl, kq):
@@ -72,7 +147,7 @@ class SpotLight(LightSource):
     # This function returns the ray that goes from the light source to a point
     def get_light_ray(self, intersection):
         # TODO
-        return Ray(intersection, normalize(self.position - intersection))
+        return Ray(intersection, normalize(self.position - intersection), normalized=True)
 
     def get_distance_from_light(self, intersection):
         return np.linalg.norm(intersection - self.position)
@@ -82,15 +157,228 @@ class SpotLight(LightSource):
         d = self.get_distance_from_light(intersection)
         return self.intensity * np.dot(self.direction, v) / (self.kc + self.kl * d + self.kq * (d ** 2))
 
+    # Batched versions, they get an (N, 3) array of points
+    def get_light_directions(self, points):
+        return normalize_rows(self.position - points)
+
+    def get_distances_from_light(self, points):
+        return np.linalg.norm(points - self.position, axis=1)
+
+    def get_intensities(self, points):
+        v = normalize_rows(points - self.position)
+        d = self.get_distances_from_light(points)
+        return self.intensity * (v @ self.direction)[:, None] / (self.kc + self.kl * d + self.kq * (d ** 2))[:, None]
+
+
+# The splitmix64 finalizer, it scrambles every bit of the uint64 array z into all the bits of the result
+def mix_bits(z):
+    z = z + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+# The lights of a scene with many lights, a drop in replacement for the list of lights of the render methods.
+# Point and spot lights are culled: a light is skipped at the points where its intensity (the largest channel) is
+# below cutoff, that is outside the sphere of radius radii[i] around it, and a spot light is skipped at the points
+# behind it. The spheres are kept in a uniform grid, so finding the lights of a point only looks at its cell.
+# cutoff=0 culls nothing and renders exactly like the list of lights.
+# With samples, a hit that is reached by more lights than that only traces shadow rays to samples lights, drawn
+# with a probability proportional to their unshadowed intensity at the hit and weighted by its inverse, so the image
+# is the same on average but noisy. The draws of a hit are a hash of seed and its coordinates (see
+# sample_uniforms), so a render gives the same image every time, whatever its tiles and worker processes.
+class LightSet:
+    def __init__(self, lights, cutoff=0.0, samples=None, seed=0, max_cells=32768):
+        self.lights = list(lights)
+        self.cutoff = cutoff
+        self.samples = samples
+        self.seed = seed
+        count = len(self.lights)
+        self.positions = np.zeros((count, 3))
+        self.attenuation = np.tile([1.0, 0.0, 0.0], (count, 1))
+        self.spot_directions = np.zeros((count, 3))
+        self.spots = np.array([isinstance(light, SpotLight) for light in self.lights], dtype=bool)
+        self.peaks = np.array([np.max(np.abs(light.intensity)) for light in self.lights], dtype=np.float64)
+        for i, light in enumerate(self.lights):
+            if hasattr(light, 'position'):
+                self.positions[i] = light.position
+                self.attenuation[i] = light.kc, light.kl, light.kq
+            if isinstance(light, SpotLight):
+                self.spot_directions[i] = light.direction
+        self.radii = np.array([self.get_radius(i) for i in range(count)])
+        self.unbounded = np.flatnonzero(self.radii == np.inf)
+        self.build_grid(np.flatnonzero(self.radii < np.inf), max_cells)
+
+    def __iter__(self):
+        return iter(self.lights)
+
+    def __len__(self):
+        return len(self.lights)
+
+    def __getitem__(self, i):
+        return self.lights[i]
+
+    # A copy of the light set for the batched methods in another precision (np.float32), the index is shared
+    def astype(self, dtype):
+        light_set = copy.copy(self)
+        light_set.lights = [light.astype(dtype) for light in self.lights]
+        return light_set
+
+    # The distance from light i at which its intensity falls to cutoff, np.inf if it never does
+    def get_radius(self, i):
+        if self.cutoff <= 0 or not hasattr(self.lights[i], 'position'):
+            return np.inf
+        kc, kl, kq = self.attenuation[i]
+        # Solve kc + kl * d + kq * d^2 = peak / cutoff for d
+        limit = self.peaks[i] / self.cutoff
+        if kc >= limit:
+            return 0.0
+        if kq > 0:
+            return (-kl + np.sqrt(kl ** 2 + 4 * kq * (limit - kc))) / (2 * kq)
+        if kl > 0:
+            return (limit - kc) / kl
+        return np.inf
+
+    # The grid covers the bounding boxes of the spheres of the bounded lights. Its cells are cubes at least as large
+    # as the median sphere diameter and there are at most about max_cells of them. The lights of every cell are
+    # stored as cell_lights[cell_start[c]:cell_start[c + 1]].
+    def build_grid(self, bounded, max_cells):
+        if not len(bounded):
+            self.grid_min, self.cell_size, self.grid_shape = np.zeros(3), 1.0, (1, 1, 1)
+            self.cell_start, self.cell_lights = np.zeros(2, dtype=int), np.zeros(0, dtype=int)
+            return
+        box_min = self.positions[bounded] - self.radii[bounded, None]
+        box_max = self.positions[bounded] + self.radii[bounded, None]
+        self.grid_min = box_min.min(axis=0)
+        extent = np.maximum(box_max.max(axis=0) - self.grid_min, 1e-12)
+        self.cell_size = max(2 * np.median(self.radii[bounded]), np.prod(extent / max_cells) ** (1 / 3), 1e-12)
+        self.grid_shape = tuple(np.maximum(np.ceil(extent / self.cell_size).astype(int), 1))
+        first = self.get_cells(box_min)
+        last = self.get_cells(box_max)
+        cells, lights = [], []
+        for light, lo, hi in zip(bounded, first, last):
+            block = np.stack(np.meshgrid(*[np.arange(lo[k], hi[k] + 1) for k in range(3)], indexing='ij'), axis=-1)
+            cells.append(np.ravel_multi_index(block.reshape(-1, 3).T, self.grid_shape))
+            lights.append(np.full(cells[-1].size, light))
+        cells, lights = np.concatenate(cells), np.concatenate(lights)
+        order = np.argsort(cells, kind='stable')
+        self.cell_lights = lights[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(np.prod(self.grid_shape) + 1))
+
+    # The grid cells (i, j, k) of (N, 3) points, clamped to the grid
+    def get_cells(self, points):
+        cells = np.floor((points - self.grid_min) / self.cell_size).astype(int)
+        return np.clip(cells, 0, np.array(self.grid_shape) - 1)
+
+    # Returns the pairs (hit, light) of the N points and the lights that reach them, as two arrays sorted by hit and
+    # then by light
+    def find_pairs(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        inside = np.all((points >= self.grid_min) & (points < self.grid_min + self.cell_size *
+                                                     np.array(self.grid_shape)), axis=1)
+        hits = np.flatnonzero(inside)
+        cells = np.ravel_multi_index(self.get_cells(points[hits]).T, self.grid_shape)
+        starts, counts = self.cell_start[cells], self.cell_start[cells + 1] - self.cell_start[cells]
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        pair_hits = np.repeat(hits, counts)
+        pair_lights = self.cell_lights[np.repeat(starts, counts) + np.arange(counts.sum()) - first]
+        near = np.linalg.norm(points[pair_hits] - self.positions[pair_lights], axis=1) < self.radii[pair_lights]
+        pair_hits = np.concatenate([pair_hits[near], np.repeat(np.arange(len(points)), len(self.unbounded))])
+        pair_lights = np.concatenate([pair_lights[near], np.tile(self.unbounded, len(points))])
+        if self.cutoff > 0:
+            to_point = points[pair_hits] - self.positions[pair_lights]
+            keep = ~self.spots[pair_lights] | (dot_rows(to_point, self.spot_directions[pair_lights]) > 0)
+            pair_hits, pair_lights = pair_hits[keep], pair_lights[keep]
+        order = np.lexsort((pair_lights, pair_hits))
+        return pair_hits[order], pair_lights[order]
+
+    # The unshadowed intensity (its largest channel) of the lights at the hits of the pairs
+    def estimate_intensities(self, points, pair_hits, pair_lights):
+        to_point = points[pair_hits] - self.positions[pair_lights]
+        d = np.linalg.norm(to_point, axis=1)
+        kc, kl, kq = self.attenuation[pair_lights].T
+        estimate = self.peaks[pair_lights] / (kc + kl * d + kq * d ** 2)
+        spots = self.spots[pair_lights]
+        estimate[spots] *= np.maximum(dot_rows(to_point[spots], self.spot_directions[pair_lights][spots]), 0) / \
+            np.maximum(d[spots], 1e-12)
+        return estimate
+
+    # Keeps samples pairs of every hit that has more, drawn with replacement by estimated intensity.
+    # Returns the kept pairs and their weights (1 for the hits that keep all their lights).
+    def sample_pairs(self, points, pair_hits, pair_lights):
+        scale = np.ones(len(pair_hits))
+        counts = np.bincount(pair_hits, minlength=len(points))
+        crowded = counts > self.samples
+        if not crowded.any():
+            return pair_hits, pair_lights, scale
+        sampled = crowded[pair_hits]
+        hits, lights = pair_hits[sampled], pair_lights[sampled]
+        estimate = np.maximum(self.estimate_intensities(points, hits, lights), 1e-300)
+        cumulative = np.cumsum(estimate)
+        group_end = np.cumsum(counts[crowded]) - 1
+        group_total = cumulative[group_end] - np.concatenate([[0], cumulative[group_end[:-1]]])
+        group_base = cumulative[group_end] - group_total
+        uniforms = self.sample_uniforms(points[crowded], self.samples)
+        targets = group_base[:, None] + uniforms * group_total[:, None]
+        picks = np.minimum(np.searchsorted(cumulative, targets.ravel(), side='right'),
+                           np.repeat(group_end, self.samples))
+        picks, times = np.unique(picks, return_counts=True)
+        group = np.searchsorted(group_end, picks)
+        weights = times * group_total[group] / (self.samples * estimate[picks])
+        pair_hits = np.concatenate([pair_hits[~sampled], hits[picks]])
+        pair_lights = np.concatenate([pair_lights[~sampled], lights[picks]])
+        scale = np.concatenate([scale[~sampled], weights])
+        order = np.lexsort((pair_lights, pair_hits))
+        return pair_hits[order], pair_lights[order], scale[order]
+
+    # Returns (N, count) numbers uniform in [0, 1) that only depend on seed and the N points: the bits of the
+    # coordinates are hashed with the splitmix64 finalizer, then the hash of each point with each sample index.
+    def sample_uniforms(self, points, count):
+        bits = np.ascontiguousarray(points, dtype=np.float64).view(np.uint64)
+        h = np.full(len(points), np.uint64(self.seed % 2 ** 64))
+        for k in range(3):
+            h = mix_bits(h ^ bits[:, k])
+        h = mix_bits(h[:, None] ^ np.arange(count, dtype=np.uint64))
+        return (h >> np.uint64(11)) * 2.0 ** -53
+
+    # Returns (light index, light, hits, scale) for every light that reaches one of the N points: the indices of
+    # those points and the factor their light is multiplied by (None when there is nothing to scale)
+    def assign(self, points):
+        pair_hits, pair_lights = self.find_pairs(points)
+        scale = None
+        if self.samples is not None:
+            pair_hits, pair_lights, scale = self.sample_pairs(points, pair_hits, pair_lights)
+        order = np.argsort(pair_lights, kind='stable')
+        pair_hits, pair_lights = pair_hits[order], pair_lights[order]
+        if scale is not None:
+            scale = scale[order]
+        bounds = np.searchsorted(pair_lights, np.arange(len(self.lights) + 1))
+        jobs = []
+        for i in np.flatnonzero(np.diff(bounds)):
+            part = slice(bounds[i], bounds[i + 1])
+            jobs.append((int(i), self.lights[i], pair_hits[part], None if scale is None else scale[part]))
+        return jobs
+
+
+# This function returns the lights to shade N points with, as (light index, light, hits, scale) tuples like
+# LightSet.assign does. A list of lights reaches all the points, with hits and scale None.
+def assign_lights(light_arr, points):
+    if isinstance(light_arr, LightSet):
+        return light_arr.assign(points)
+    return [(i, light, None, None) for i, light in enumerate(light_arr)]
+
 
 class Ray:
-    def __init__(self, origin, direction):
+    # A direction that is already a unit vector (normalized=True) is kept as is instead of being normalized again
+    def __init__(self, origin, direction, normalized=False):
         self.origin = origin
-        self.direction = normalize(np.array(direction, dtype=np.float64))
+        self.direction = direction if normalized else normalize(np.array(direction, dtype=np.float64))
 
     # The function is getting the collection of objects in the scene and looks for the one with minimum distance.
     # The function should return the nearest object and its distance (in two different arguments)
     def nearest_intersected_object(self, objects):
+        if isinstance(objects, Scene):
+            return objects.nearest_intersected_object(self)
         nearest_object = None
         min_distance = np.inf
         for current_obj in objects:
@@ -102,6 +390,18 @@ class Ray:
 
         return nearest_object, min_distance
 
+    # The function looks for any object that blocks the ray before max_distance and returns its index, -1 if the
+    # way is clear. It stops at the first blocking object, the object at index cached is tested first.
+    def find_occluder(self, objects, max_distance, cached=-1):
+        if isinstance(objects, Scene):
+            return objects.find_occluder(self, max_distance, cached)
+        if cached >= 0 and objects[cached].occludes(self, max_distance):
+            return cached
+        for i, current_obj in enumerate(objects):
+            if i != cached and current_obj.occludes(self, max_distance):
+                return i
+        return -1
+
     # helper function that get the new point.
     def get_new_point(self, t: float) -> np.array:
         if t > 0:
@@ -118,6 +418,23 @@ class Object3D:
         self.shininess = shininess
         self.reflection = reflection
 
+    # This function returns the (min, max) corners of the bounding box of the object, None if it is unbounded
+    def get_bounds(self):
+        return None
+
+    # Shadow (any-hit) queries: does the object block the ray before max_distance
+    def occludes(self, ray, max_distance):
+        hit_obj, t = self.intersect(ray)
+        return hit_obj is not None and t <= max_distance
+
+    def occludes_batch(self, origins, directions, max_distances):
+        t, _ = self.intersect_batch(origins, directions)
+        return blocks(t, max_distances)
+
+    # A copy of the object for the batched methods in another precision (np.float32)
+    def astype(self, dtype):
+        return cast_arrays(self, dtype)
+
 
 class Plane(Object3D):
     def __init__(self, normal, point):
@@ -129,6 +446,8 @@ class Plane(Object3D):
         return self.normal
 
     def intersect(self, ray: Ray):
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Plane', 1)
         v = self.point - ray.origin
         t = (np.dot(v, self.normal) / np.dot(self.normal, ray.direction))
         if t > 0:
@@ -136,6 +455,26 @@ class Plane(Object3D):
         else:
             return None, None
 
+    # Batched intersection of N rays given as (N, 3) arrays.
+    # Returns the distance of every ray (np.inf for a miss) and the index of the primitive that was hit.
+    def intersect_batch(self, origins, directions):
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Plane', len(origins))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((self.point - origins) @ self.normal) / (directions @ self.normal)
+        t = np.where(t > 0, t, np.inf)
+        return t, np.zeros(len(t), dtype=int)
+
+    def compute_normal_batch(self, points, prim):
+        return np.broadcast_to(self.normal, points.shape)
+
+    def transformed(self, transform):
+        plane = copy.copy(self)
+        plane.normal = normalize(np.linalg.inv(transform[:3, :3]).T @ self.normal)
+        plane.point = transform_points(transform, self.point)
+        plane.d = -np.dot(plane.normal, plane.point)
+        return plane
+
 
 class Triangle(Object3D):
     # Triangle gets 3 points as arguments
@@ -166,6 +505,8 @@ class Triangle(Object3D):
     # Hint: First find the intersection on the plane
     # Later, find if the point is in the triangle using barycentric coordinates
     def intersect(self, ray: Ray):
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Triangle', 1)
         d = -np.dot(self.normal, self.a)
         intersection, t = None, None
         if np.dot(self.normal, ray.direction) != 0:
@@ -176,6 +517,34 @@ class Triangle(Object3D):
         else:
             return None, None
 
+    def intersect_batch(self, origins, directions):
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Triangle', len(origins))
+        d = -np.dot(self.normal, self.a)
+        denom = directions @ self.normal
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = -(origins @ self.normal + d) / denom
+            p = origins + t[:, None] * directions
+            hit = (denom != 0) & (t > 0)
+            hit &= np.cross(self.b - self.a, p - self.a) @ self.normal >= 0
+            hit &= np.cross(self.c - self.b, p - self.b) @ self.normal >= 0
+            hit &= np.cross(self.a - self.c, p - self.c) @ self.normal >= 0
+        return np.where(hit, t, np.inf), np.zeros(len(t), dtype=int)
+
+    def compute_normal_batch(self, points, prim):
+        return np.broadcast_to(self.normal, points.shape)
+
+    def get_bounds(self):
+        points = np.array([self.a, self.b, self.c])
+        return points.min(axis=0), points.max(axis=0)
+
+    def transformed(self, transform):
+        triangle = copy.copy(self)
+        triangle.a, triangle.b, triangle.c = transform_points(transform, np.array([self.a, self.b, self.c]))
+        triangle.normal = None
+        triangle.normal = triangle.compute_normal(None)
+        return triangle
+
 
 class Sphere(Object3D):
     def __init__(self, center, radius: float):
@@ -185,53 +554,274 @@ class Sphere(Object3D):
     def compute_normal(self, P):
         return normalize(P - self.center)
 
+    # The ray-sphere quadratic is solved in closed form, a negative discriminant means the ray misses the sphere.
+    # The nearest positive root is the intersection.
     def intersect(self, ray: Ray):
-        a = np.sum(ray.direction ** 2)
-        b = np.sum(2 * ray.direction * (ray.origin - self.center))
-        c = np.sum((ray.origin - self.center) ** 2) - self.radius ** 2
-        coeff = np.array([a, b, c], dtype=np.float64)
-        roots = np.roots(coeff)
-        if np.isreal(roots[0]):
-            roots.sort()
-            if roots[0] > 0:
-                return self, roots[0]
-            elif roots[1] > 0:
-                return self, roots[1]
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Sphere', 1)
+        oc = ray.origin - self.center
+        a = np.dot(ray.direction, ray.direction)
+        b = 2 * np.dot(ray.direction, oc)
+        c = np.dot(oc, oc) - self.radius ** 2
+        discriminant = b ** 2 - 4 * a * c
+        if discriminant < 0:
+            return None, None
+        sqrt_discriminant = np.sqrt(discriminant)
+        for t in ((-b - sqrt_discriminant) / (2 * a), (-b + sqrt_discriminant) / (2 * a)):
+            if t > 0:
+                return self, t
         return None, None
 
+    def intersect_batch(self, origins, directions):
+        t = intersect_spheres(origins, directions, self.center[None, :], np.array([self.radius]))[:, 0]
+        return t, np.zeros(len(t), dtype=int)
+
+    def compute_normal_batch(self, points, prim):
+        return normalize_rows(points - self.center)
+
+    def get_bounds(self):
+        return self.center - self.radius, self.center + self.radius
+
+    # A sphere stays a sphere under rotations, translations and uniform scaling (similarity transforms, whose linear
+    # part L has L^T L = s^2 I), any other transform would make it an ellipsoid and raises a ValueError
+    def transformed(self, transform):
+        linear = np.asarray(transform, dtype=np.float64)[:3, :3]
+        gram = linear.T @ linear
+        scale = np.trace(gram) / 3
+        if not scale > 0 or np.abs(gram - scale * np.eye(3)).max() > 1e-9 * scale:
+            raise ValueError('a sphere can only be moved by a similarity transform, not {}'.format(linear.tolist()))
+        sphere = copy.copy(self)
+        sphere.center = transform_points(transform, self.center)
+        sphere.radius = self.radius * np.cbrt(abs(np.linalg.det(transform[:3, :3])))
+        return sphere
+
+
+# Intersects N rays with M spheres in one array operation, the rays are (N, 3) arrays and the spheres are
+# given by an (M, 3) array of centers and an (M,) array of radii.
+# Returns an (N, M) array of the distance from every ray to every sphere, np.inf where the ray misses the sphere.
+def intersect_spheres(origins, directions, centers, radii):
+    if render_stats.active is not None:
+        render_stats.active.count_tests('Sphere', len(origins), len(centers))
+    oc = origins[:, None, :] - centers[None, :, :]
+    a = np.sum(directions ** 2, axis=1)[:, None]
+    b = 2 * np.einsum('nj,nmj->nm', directions, oc)
+    c = np.sum(oc ** 2, axis=2) - np.asarray(radii, dtype=origins.dtype) ** 2
+    discriminant = b ** 2 - 4 * a * c
+    sqrt_discriminant = np.sqrt(np.maximum(discriminant, 0))
+    near = (-b - sqrt_discriminant) / (2 * a)
+    far = (-b + sqrt_discriminant) / (2 * a)
+    t = np.where(near > 0, near, np.where(far > 0, far, np.inf))
+    return np.where(discriminant >= 0, t, np.inf)
 
-def get_current_color(ambient, light_arr, obj: Object3D, obj_arr, ray: Ray, hit_point, max_depth, camera, level=0):
+
+# shadow_cache is an optional dict that keeps the last occluder found for every light (by index in light_arr),
+# it is tested first by the next shadow ray towards the same light.
+# The normal, the shifted hit point and the view direction are computed once per hit and shared by all the lights.
+def get_current_color(ambient, light_arr, obj: Object3D, obj_arr, ray: Ray, hit_point, max_depth, camera, level=0,
+                      shadow_cache=None):
     # base case
     if obj is None or level == max_depth:
         return np.array([0, 0, 0], dtype=np.float64)
 
+    stats = render_stats.active
+    if stats is not None:
+        stats.start('shade')
     color = obj.ambient * np.array(ambient, dtype=np.float64)
+    normal = obj.compute_normal(hit_point)
+    shifted = hit_point + (1e-10 * normal)
+    view = -ray.direction
 
-    for light in light_arr:
+    for light_index, light, _, scale in assign_lights(light_arr, hit_point[None, :]):
+        if stats is not None:
+            stats.count_rays('shadow')
 
-        shifted = hit_point + (1e-10 * obj.compute_normal(hit_point))
         hit_to_light = light.get_light_ray(shifted)
-        hit_to_light_obj, hit_to_light_dis = hit_to_light.nearest_intersected_object(obj_arr)
+        cached = shadow_cache.get(light_index, -1) if shadow_cache is not None else -1
+        occluder = hit_to_light.find_occluder(obj_arr, light.get_distance_from_light(hit_point), cached)
+        if shadow_cache is not None and occluder >= 0:
+            shadow_cache[light_index] = occluder
 
-        if hit_to_light_obj is None or hit_to_light_dis > light.get_distance_from_light(hit_point):
-            color += obj.diffuse * light.get_intensity(hit_point) * np.dot(obj.compute_normal(hit_point),
-                                                                           hit_to_light.direction)
-            color += obj.specular * light.get_intensity(hit_point) * np.power(
-                np.dot(reflected(-hit_to_light.direction, obj.compute_normal(hit_point)), -ray.direction),
-                obj.shininess)
+        if occluder < 0:
+            intensity = light.get_intensity(hit_point)
+            if scale is not None:
+                intensity = intensity * scale[0]
+            color += obj.diffuse * intensity * np.dot(normal, hit_to_light.direction)
+            color += obj.specular * intensity * np.power(
+                np.dot(reflected(-hit_to_light.direction, normal), view), obj.shininess)
 
     if obj.reflection > 0:
-
-        r_ray = Ray(shifted, reflected(ray.direction, obj.compute_normal(hit_point)))
+        if stats is not None:
+            stats.count_rays('reflection')
+            stats.start('reflect')
+        r_ray = Ray(shifted, reflected(ray.direction, normal), normalized=True)
         next_obj, next_dist = r_ray.nearest_intersected_object(obj_arr)
         nextHitP = r_ray.get_new_point(next_dist)
+        if stats is not None:
+            stats.stop()
 
         if next_obj:
             color += get_current_color(ambient, light_arr, next_obj, obj_arr, r_ray, nextHitP, max_depth, camera,
-                                       level + 1) * obj.reflection
+                                       level + 1, shadow_cache) * obj.reflection
+    if stats is not None:
+        stats.stop()
     return color
 
 
+# Batched counterpart of Ray.nearest_intersected_object, rays are given as (N, 3) arrays of origins and directions.
+# Returns for every ray the distance, the index of the nearest object (-1 for a miss) and the primitive inside it.
+def nearest_intersected_objects(objects, origins, directions):
+    if isinstance(objects, Scene):
+        return objects.nearest_intersected_objects(origins, directions)
+    nearest = np.full(len(origins), np.inf, dtype=origins.dtype)
+    obj_idx = np.full(len(origins), -1)
+    prim_idx = np.zeros(len(origins), dtype=int)
+    # All the spheres are tested together with intersect_spheres
+    spheres = np.array([i for i, obj in enumerate(objects) if isinstance(obj, Sphere)], dtype=int)
+    if len(spheres):
+        t = intersect_spheres(origins, directions, np.array([objects[i].center for i in spheres], dtype=origins.dtype),
+                              np.array([objects[i].radius for i in spheres]))
+        nearest_sphere = np.argmin(t, axis=1)
+        nearest = t[np.arange(len(t)), nearest_sphere]
+        obj_idx = np.where(nearest < np.inf, spheres[nearest_sphere], -1)
+    for i, current_obj in enumerate(objects):
+        if isinstance(current_obj, Sphere):
+            continue
+        t, prim = current_obj.intersect_batch(origins, directions)
+        closer = (t < nearest) | ((t == nearest) & (t < np.inf) & (i < obj_idx))
+        nearest[closer] = t[closer]
+        obj_idx[closer] = i
+        prim_idx[closer] = prim[closer]
+    return nearest, obj_idx, prim_idx
+
+
+# Batched counterpart of Ray.find_occluder, max_distances is an (N,) array.
+# Returns for every ray the index of an object that blocks it, -1 if the way to the light is clear.
+def find_occluders(objects, origins, directions, max_distances, cached=-1):
+    if isinstance(objects, Scene):
+        return objects.find_occluders(origins, directions, max_distances, cached)
+    blocker = np.full(len(origins), -1)
+    order = ([cached] if cached >= 0 else []) + [i for i in range(len(objects)) if i != cached]
+    for i in order:
+        open_rays = np.flatnonzero(blocker < 0)
+        if not len(open_rays):
+            break
+        if render_stats.active is not None:
+            render_stats.active.push_rays(open_rays)
+        blocked = objects[i].occludes_batch(origins[open_rays], directions[open_rays], max_distances[open_rays])
+        if render_stats.active is not None:
+            render_stats.active.pop_rays()
+        blocker[open_rays[blocked]] = i
+    return blocker
+
+
+# The materials of all the objects gathered into arrays, so they can be indexed by object index.
+class MaterialTable:
+    def __init__(self, objects, dtype=np.float64):
+        self.ambient = np.array([obj.ambient for obj in objects], dtype=dtype).reshape(-1, 3)
+        self.diffuse = np.array([obj.diffuse for obj in objects], dtype=dtype).reshape(-1, 3)
+        self.specular = np.array([obj.specular for obj in objects], dtype=dtype).reshape(-1, 3)
+        self.shininess = np.array([obj.shininess for obj in objects], dtype=dtype)
+        self.reflection = np.array([obj.reflection for obj in objects], dtype=dtype)
+
+
+def compute_normals(objects, points, obj_idx, prim_idx):
+    normals = np.empty_like(points)
+    for i in np.unique(obj_idx):
+        sel = obj_idx == i
+        normals[sel] = objects[i].compute_normal_batch(points[sel], prim_idx[sel])
+    return normals
+
+
+# Ambient and direct light of N hits, shadow rays towards every light are traced as one packet.
+# With a LightSet every light only gets the packet of the hits it reaches.
+def get_direct_colors(ambient, light_arr, objects, materials, directions, hit_points, obj_idx, normals, shifted,
+                      shadow_cache=None):
+    colors = materials.ambient[obj_idx] * np.asarray(ambient, dtype=hit_points.dtype)
+    stats = render_stats.active
+    for light_index, light, hits, scale in assign_lights(light_arr, hit_points):
+        points, sources = (hit_points, shifted) if hits is None else (hit_points[hits], shifted[hits])
+        if stats is not None:
+            stats.count_rays('shadow', len(sources))
+            if hits is not None:
+                stats.push_rays(hits)
+        to_light = light.get_light_directions(sources)
+        cached = shadow_cache.get(light_index, -1) if shadow_cache is not None else -1
+        blocker = find_occluders(objects, sources, to_light, light.get_distances_from_light(points), cached)
+        if stats is not None and hits is not None:
+            stats.pop_rays()
+        lit = blocker < 0
+        if shadow_cache is not None and not lit.all():
+            # The object that blocked most of the packet is tested first next time
+            shadow_cache[light_index] = int(np.argmax(np.bincount(blocker[~lit])))
+        if not lit.any():
+            continue
+        intensity = light.get_intensities(points[lit])
+        if scale is not None:
+            intensity = intensity * scale[lit, None].astype(intensity.dtype)
+        lit_to_light = to_light[lit]
+        if hits is not None:
+            lit = hits[lit]
+        lit_obj, lit_normals = obj_idx[lit], normals[lit]
+        colors[lit] += materials.diffuse[lit_obj] * intensity * dot_rows(lit_normals, lit_to_light)[:, None]
+        colors[lit] += materials.specular[lit_obj] * intensity * np.power(
+            dot_rows(reflected_rows(-lit_to_light, lit_normals), -directions[lit]),
+            materials.shininess[lit_obj])[:, None]
+    return colors
+
+
+# Batched counterpart of get_current_color, it shades N hits at once.
+# directions are the directions of the rays that hit, obj_idx and prim_idx are the hit objects and primitives.
+# Instead of recursing, reflections are traced as a wavefront: at every depth all the rays that are still active
+# are intersected and shaded together, and their color is added with the weight of their path (the product of the
+# reflection coefficients along it). Rays whose weight falls to min_weight or below are dropped.
+# The colors are computed in the precision (dtype) of hit_points.
+def get_current_colors(ambient, light_arr, objects, materials, directions, hit_points, obj_idx, prim_idx, max_depth,
+                       shadow_cache=None, min_weight=0.0):
+    colors = np.zeros((len(hit_points), 3), dtype=hit_points.dtype)
+    # Every active ray has at most one child, so the pixels of a wavefront are unique
+    pixels = np.arange(len(hit_points))
+    weights = np.ones(len(hit_points), dtype=hit_points.dtype)
+    stats = render_stats.active
+    for level in range(max_depth):
+        if not len(pixels):
+            break
+        if stats is not None:
+            # The queries of this depth trace one ray per pixel of the wavefront
+            stats.push_rays(pixels)
+            stats.start('shade')
+        normals = compute_normals(objects, hit_points, obj_idx, prim_idx)
+        shifted = hit_points + (surface_offset(hit_points) * normals)
+        colors[pixels] += weights[:, None] * get_direct_colors(ambient, light_arr, objects, materials, directions,
+                                                               hit_points, obj_idx, normals, shifted, shadow_cache)
+        if stats is not None:
+            stats.stop()
+        if level + 1 == max_depth:
+            if stats is not None:
+                stats.pop_rays()
+            break
+
+        next_weights = weights * materials.reflection[obj_idx]
+        active = np.flatnonzero((materials.reflection[obj_idx] > 0) & (next_weights > min_weight))
+        if stats is not None:
+            stats.count_rays('reflection', len(active))
+            stats.start('reflect')
+            stats.push_rays(active)
+        r_origins = shifted[active]
+        r_directions = reflected_rows(directions[active], normals[active])
+        next_dist, next_obj, next_prim = nearest_intersected_objects(objects, r_origins, r_directions)
+        if stats is not None:
+            stats.pop_rays()
+            stats.stop()
+            stats.pop_rays()
+        hit = next_obj >= 0
+        active = active[hit]
+        pixels, weights = pixels[active], next_weights[active]
+        directions = r_directions[hit]
+        hit_points = r_origins[hit] + next_dist[hit, None] * directions
+        obj_idx, prim_idx = next_obj[hit], next_prim[hit]
+    return colors
+
+
 def remove_array(ls, arr):
     i = 0
     size = len(ls)
@@ -241,23 +831,440 @@ def remove_array(ls, arr):
         ls.pop(i)
 
 
+# Intersects N rays with F triangles with the Moller-Trumbore algorithm in one array operation.
+# The triangles are given by (F, 3) arrays of their first vertex and their two edges from it.
+# Returns an (N, F) array of the distance from every ray to every triangle, np.inf where the ray misses it.
+def intersect_triangles(origins, directions, v0, edge1, edge2):
+    pvec = np.cross(directions[:, None, :], edge2[None, :, :])
+    det = np.einsum('fj,nfj->nf', edge1, pvec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1 / det
+        tvec = origins[:, None, :] - v0[None, :, :]
+        u = np.einsum('nfj,nfj->nf', tvec, pvec) * inv_det
+        qvec = np.cross(tvec, edge1[None, :, :])
+        v = np.einsum('nj,nfj->nf', directions, qvec) * inv_det
+        t = np.einsum('fj,nfj->nf', edge2, qvec) * inv_det
+        hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+    return np.where(hit, t, np.inf)
+
+
 class Mesh(Object3D):
     # Mesh are defined by a list of vertices, and a list of faces.
     # The faces are triplets of vertices by their index number.
+    # The mesh is kept as contiguous (V, 3) vertex and (F, 3) face arrays with the first vertex, edges and normal of
+    # every face precomputed, no Triangle object is created per face.
+    # The arrays a mesh is made of, see to_arrays and from_arrays
+    ARRAYS = ('vertices', 'faces', 'v0', 'edge1', 'edge2', 'normals', 'visible')
+
+    # Vertex and face arrays are kept in their own floating point and integer types, so the memory mapped arrays of
+    # a binary PLY (see mesh_io.read_ply) are used without a copy. The face arrays below are computed in float64.
     def __init__(self, v_list, f_list):
         self.v_list = v_list
         self.f_list = f_list
-        self.triangle_list = self.create_triangle_list()
+        self.vertices = np.asarray(v_list).reshape(-1, 3)
+        if not np.issubdtype(self.vertices.dtype, np.floating):
+            self.vertices = self.vertices.astype(np.float64)
+        self.faces = np.asarray(f_list).reshape(-1, 3)
+        if not np.issubdtype(self.faces.dtype, np.integer):
+            self.faces = self.faces.astype(np.int64)
+        self.triangles = {}
+        self.casts = {}
+        self.build_face_arrays()
+        self.bvh = self.build_bvh()
+
+    # A mesh made of the face arrays saved by to_arrays and a BVH over its faces (None for an empty mesh),
+    # nothing is computed again
+    @classmethod
+    def from_arrays(cls, arrays, bvh):
+        mesh = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(mesh, name, arrays[name])
+        mesh.v_list, mesh.f_list = mesh.vertices, mesh.faces
+        mesh.triangles = {}
+        mesh.casts = {}
+        mesh.bvh = bvh
+        return mesh
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def astype(self, dtype):
+        mesh = cast_arrays(self, dtype)
+        mesh.triangles = {}
+        mesh.casts = {}
+        mesh.bvh = self.bvh.astype(dtype) if self.bvh is not None else None
+        return mesh
+
+    # The copy of the mesh in dtype that all its instances share, it is only made once
+    def shared_astype(self, dtype):
+        key = np.dtype(dtype).str
+        if key not in self.casts:
+            self.casts[key] = self.astype(dtype)
+        return self.casts[key]
+
+    # The first vertex, edges and normal of every face are (F, 3) float64 arrays that the intersection tests use
+    # directly, they are the only per face copies of the mesh
+    def build_face_arrays(self):
+        corners = self.vertices[self.faces].astype(np.float64, copy=False)
+        self.v0 = corners[:, 0]
+        self.edge1 = corners[:, 1] - corners[:, 0]
+        self.edge2 = corners[:, 2] - corners[:, 0]
+        # The same normal as Triangle.compute_normal: a is the vertex with the largest x, b the remaining one with
+        # the largest y and the normal is (b - a) x (c - a)
+        face = np.arange(len(corners))
+        a = np.argmax(corners[:, :, 0], axis=1)
+        rest = np.array([[1, 2], [0, 2], [0, 1]])[a]
+        second = corners[face, rest[:, 1], 1] > corners[face, rest[:, 0], 1]
+        b = np.where(second, rest[:, 1], rest[:, 0])
+        c = np.where(second, rest[:, 0], rest[:, 1])
+        a, b, c = corners[face, a], corners[face, b], corners[face, c]
+        self.normals = normalize_rows(np.cross(b - a, c - a)) if len(corners) else np.zeros((0, 3))
+        # Triangle only reports hits when that normal agrees with the winding of the face, keep the same faces visible
+        self.visible = np.einsum('ij,ij->i', np.cross(self.edge1, self.edge2), self.normals) > 0
 
     def create_triangle_list(self):
-        l = [Triangle(self.v_list[i[0]], self.v_list[i[1]], self.v_list[i[2]]) for i in self.f_list]
-        return l
+        return [self.get_triangle(i) for i in range(len(self.faces))]
+
+    # Triangle objects are only created on demand, for the faces hit by single rays
+    def get_triangle(self, i):
+        if i not in self.triangles:
+            triangle = Triangle(*self.vertices[self.faces[i]])
+            if hasattr(self, 'ambient'):
+                triangle.set_material(self.ambient, self.diffuse, self.specular, self.shininess, self.reflection)
+            self.triangles[i] = triangle
+        return self.triangles[i]
+
+    @property
+    def triangle_list(self):
+        return self.create_triangle_list()
+
+    # The BVH over the triangles is built once, intersections then only test the triangles of the leaves they reach
+    def build_bvh(self):
+        if not len(self.faces):
+            return None
+        corners = self.vertices[self.faces]
+        return BVH(corners.min(axis=1), corners.max(axis=1))
+
+    def get_bounds(self):
+        if self.bvh is None:
+            return None
+        return self.bvh.node_min[0], self.bvh.node_max[0]
 
     def apply_materials_to_triangles(self):
-        for t in self.triangle_list:
+        for t in self.triangles.values():
             t.set_material(self.ambient, self.diffuse, self.specular, self.shininess, self.reflection)
 
+    # Moller-Trumbore test of rays against a subset of the faces, returns a (faces, rays) array of distances
+    def intersect_faces(self, faces, origins, directions):
+        if render_stats.active is not None:
+            render_stats.active.count_tests('Triangle', len(origins), len(faces))
+        t = intersect_triangles(origins, directions, self.v0[faces], self.edge1[faces], self.edge2[faces])
+        t[:, ~self.visible[faces]] = np.inf
+        return t.T
+
     # Hint: Intersect returns both distance and nearest object.
     # Keep track of both.
     def intersect(self, ray: Ray):
-        return ray.nearest_intersected_object(self.triangle_list)
+        if self.bvh is None:
+            return None, np.inf
+        t, face = self.nearest_face(ray.origin, ray.direction)
+        if face < 0:
+            return None, np.inf
+        return self.get_triangle(face), t
+
+    # Returns the distance and the index of the nearest face along one ray, -1 for a miss
+    def nearest_face(self, origin, direction):
+        t, face, _ = self.bvh.nearest(origin, direction, lambda faces: (
+            self.intersect_faces(faces, origin[None, :], direction[None, :])[:, 0], faces))
+        return t, face
+
+    def occludes(self, ray: Ray, max_distance):
+        if self.bvh is None:
+            return False
+        return self.bvh.any_hit(ray.origin, ray.direction, max_distance, lambda faces: (
+            blocks(self.intersect_faces(faces, ray.origin[None, :], ray.direction[None, :])[:, 0], max_distance))) >= 0
+
+    def occludes_batch(self, origins, directions, max_distances):
+        if self.bvh is None:
+            return np.zeros(len(origins), dtype=bool)
+        return self.bvh.any_hit_batch(origins, directions, max_distances, lambda faces, o, d, m: (
+            blocks(self.intersect_faces(faces, o, d), m[None, :]))) >= 0
+
+    # The primitive index returned for every ray is the index of the face it hit
+    def intersect_batch(self, origins, directions):
+        if self.bvh is None:
+            return np.full(len(origins), np.inf, dtype=origins.dtype), np.zeros(len(origins), dtype=int)
+        t, face, _ = self.bvh.nearest_batch(origins, directions, lambda faces, o, d: (
+            self.intersect_faces(faces, o, d), np.zeros((len(faces), len(o)), dtype=int)))
+        return t, np.maximum(face, 0)
+
+    def compute_normal_batch(self, points, prim):
+        return self.normals[prim]
+
+    # A moved mesh is an Instance of it, the faces and the BVH are not computed again
+    def transformed(self, transform):
+        instance = Instance(self, transform)
+        if hasattr(self, 'ambient'):
+            instance.set_material(self.ambient, self.diffuse, self.specular, self.shininess, self.reflection)
+        return instance
+
+
+# 4x4 affine transforms for Instance
+def translation_matrix(offset):
+    matrix = np.eye(4)
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def scale_matrix(factors):
+    return np.diag(np.append(np.broadcast_to(np.asarray(factors, dtype=np.float64), 3), 1))
+
+
+# Rotation by angle radians around axis, counterclockwise when the axis points to the viewer
+def rotation_matrix(axis, angle):
+    x, y, z = normalize(np.array(axis, dtype=np.float64))
+    cos, sin = np.cos(angle), np.sin(angle)
+    matrix = np.eye(4)
+    matrix[:3, :3] = cos * np.eye(3) + sin * np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]]) + \
+        (1 - cos) * np.outer([x, y, z], [x, y, z])
+    return matrix
+
+
+# A copy of a mesh placed in the scene by a 4x4 affine transform from the space of the mesh to the world, with its
+# own material. Any number of instances can share one Mesh, its faces and BVH are stored once.
+# Rays are moved to the space of the mesh for the intersection tests. Their directions are not normalized there,
+# so the distances along them stay world distances. The normals are moved back with the inverse transpose.
+# The faces that are seen are the visible faces of the mesh in its own space, a rotated instance can show faces that
+# a Mesh built from the rotated vertices would hide (see Mesh.build_face_arrays).
+class Instance(Object3D):
+    def __init__(self, mesh, transform):
+        self.mesh = mesh
+        self.set_transform(transform)
+
+    def set_transform(self, transform):
+        self.transform = np.array(transform, dtype=np.float64)
+        self.inverse = np.linalg.inv(self.transform)
+        self.normal_matrix = self.inverse[:3, :3].T
+        self.triangles = {}
+
+    def transformed(self, transform):
+        instance = copy.copy(self)
+        instance.set_transform(np.asarray(transform) @ self.transform)
+        return instance
+
+    def set_material(self, ambient, diffuse, specular, shininess, reflection):
+        super().set_material(ambient, diffuse, specular, shininess, reflection)
+        self.triangles = {}
+
+    # A copy of the instance in another precision, all the instances of a mesh still share one copy of it
+    def astype(self, dtype):
+        instance = cast_arrays(self, dtype)
+        instance.mesh = self.mesh.shared_astype(dtype)
+        instance.triangles = {}
+        return instance
+
+    # This function moves (N, 3) world points and directions to the space of the mesh
+    def to_mesh_space(self, origins, directions):
+        return transform_points(self.inverse, origins), directions @ self.inverse[:3, :3].T
+
+    # The box around the transformed corners of the box of the mesh
+    def get_bounds(self):
+        bounds = self.mesh.get_bounds()
+        if bounds is None:
+            return None
+        corners = np.array(np.meshgrid(*zip(*bounds), indexing='ij')).reshape(3, -1).T
+        corners = transform_points(self.transform, corners)
+        return corners.min(axis=0), corners.max(axis=0)
+
+    # The face of the mesh in world space as a Triangle with the material of the instance, made when it is first hit
+    def get_triangle(self, i):
+        if i not in self.triangles:
+            corners = transform_points(self.transform, self.mesh.vertices[self.mesh.faces[i]])
+            triangle = Triangle(*corners)
+            triangle.normal = normalize(self.normal_matrix @ self.mesh.normals[i])
+            if hasattr(self, 'ambient'):
+                triangle.set_material(self.ambient, self.diffuse, self.specular, self.shininess, self.reflection)
+            self.triangles[i] = triangle
+        return self.triangles[i]
+
+    def intersect(self, ray: Ray):
+        if self.mesh.bvh is None:
+            return None, np.inf
+        origins, directions = self.to_mesh_space(ray.origin[None, :], ray.direction[None, :])
+        t, face = self.mesh.nearest_face(origins[0], directions[0])
+        if face < 0:
+            return None, np.inf
+        return self.get_triangle(face), t
+
+    def occludes(self, ray: Ray, max_distance):
+        origins, directions = self.to_mesh_space(ray.origin[None, :], ray.direction[None, :])
+        return self.mesh.occludes_batch(origins, directions, np.array([max_distance]))[0]
+
+    def occludes_batch(self, origins, directions, max_distances):
+        return self.mesh.occludes_batch(*self.to_mesh_space(origins, directions), max_distances)
+
+    def intersect_batch(self, origins, directions):
+        return self.mesh.intersect_batch(*self.to_mesh_space(origins, directions))
+
+    def compute_normal_batch(self, points, prim):
+        return normalize_rows(self.mesh.normals[prim] @ self.normal_matrix.T)
+
+
+# This function returns (distance, hit object) of a single intersection, with np.inf as the distance of a miss
+def intersect_or_inf(obj, ray):
+    hit_obj, t = obj.intersect(ray)
+    if hit_obj is None:
+        return np.inf, None
+    return t, hit_obj
+
+
+# The objects of a scene together with a BVH over the bounded ones, that is built once and replaces the linear scan
+# of Ray.nearest_intersected_object. Unbounded objects (planes) are still tested one by one.
+# A Scene can be used wherever a list of objects is expected.
+# A bvh built before over the bounded objects (in their order) can be given instead of building it again.
+class Scene:
+    def __init__(self, objects, leaf_size=4, bvh=None):
+        self.objects = list(objects)
+        bounds = [obj.get_bounds() for obj in self.objects]
+        self.bounded = np.array([i for i, b in enumerate(bounds) if b is not None], dtype=int)
+        self.unbounded = [i for i, b in enumerate(bounds) if b is None]
+        self.bvh = bvh
+        if bvh is None and len(self.bounded):
+            self.bvh = BVH([bounds[i][0] for i in self.bounded], [bounds[i][1] for i in self.bounded],
+                           leaf_size=leaf_size)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __getitem__(self, i):
+        return self.objects[i]
+
+    # A copy of the scene for the batched methods in another precision (np.float32), the BVH is not built again.
+    # Meshes are cast once and the copy is kept with them, so scenes that share a mesh share its copy too.
+    def astype(self, dtype):
+        return Scene([obj.shared_astype(dtype) if isinstance(obj, Mesh) else obj.astype(dtype) for obj in self.objects],
+                     bvh=self.bvh.astype(dtype) if self.bvh is not None else None)
+
+    # A scene of moved objects, objects[i] is self.objects[i] after it moved. The BVH keeps its tree and is only
+    # refit to the new bounds of the objects.
+    def refit(self, objects):
+        bounds = [objects[i].get_bounds() for i in self.bounded]
+        bvh = None
+        if self.bvh is not None:
+            bvh = self.bvh.refit([b[0] for b in bounds], [b[1] for b in bounds])
+        return Scene(objects, bvh=bvh)
+
+    # The BVH leaf callbacks, prims are indices into self.bounded
+    def intersect_leaf(self, prims, ray: Ray):
+        hits = [intersect_or_inf(self.objects[self.bounded[i]], ray) for i in prims]
+        return np.array([hit[0] for hit in hits]), [hit[1] for hit in hits]
+
+    def intersect_leaf_batch(self, prims, origins, directions):
+        hits = [self.objects[self.bounded[i]].intersect_batch(origins, directions) for i in prims]
+        return np.array([hit[0] for hit in hits]), np.array([hit[1] for hit in hits])
+
+    def nearest_intersected_object(self, ray: Ray):
+        nearest_object, min_distance, nearest_index = None, np.inf, -1
+        if self.bvh is not None:
+            min_distance, prim, nearest_object = self.bvh.nearest(
+                ray.origin, ray.direction, lambda prims: self.intersect_leaf(prims, ray))
+            nearest_index = self.bounded[prim] if prim >= 0 else -1
+        for i in self.unbounded:
+            t, hit_obj = intersect_or_inf(self.objects[i], ray)
+            if t < min_distance or (t == min_distance and t < np.inf and i < nearest_index):
+                nearest_object, min_distance, nearest_index = hit_obj, t, i
+        return nearest_object, min_distance
+
+    def nearest_intersected_objects(self, origins, directions):
+        nearest = np.full(len(origins), np.inf, dtype=origins.dtype)
+        obj_idx = np.full(len(origins), -1)
+        prim_idx = np.zeros(len(origins), dtype=int)
+        if self.bvh is not None:
+            nearest, prim, prim_idx = self.bvh.nearest_batch(origins, directions, self.intersect_leaf_batch)
+            obj_idx = np.where(prim >= 0, self.bounded[np.maximum(prim, 0)], -1)
+        for i in self.unbounded:
+            t, prim = self.objects[i].intersect_batch(origins, directions)
+            closer = (t < nearest) | ((t == nearest) & (t < np.inf) & (i < obj_idx))
+            nearest[closer] = t[closer]
+            obj_idx[closer] = i
+            prim_idx[closer] = prim[closer]
+        return nearest, obj_idx, prim_idx
+
+    def find_occluder(self, ray: Ray, max_distance, cached=-1):
+        if cached >= 0 and self.objects[cached].occludes(ray, max_distance):
+            return cached
+        for i in self.unbounded:
+            if i != cached and self.objects[i].occludes(ray, max_distance):
+                return i
+        if self.bvh is not None:
+            prim = self.bvh.any_hit(ray.origin, ray.direction, max_distance, lambda prims: np.array(
+                [self.objects[self.bounded[i]].occludes(ray, max_distance) for i in prims]))
+            if prim >= 0:
+                return self.bounded[prim]
+        return -1
+
+    def find_occluders(self, origins, directions, max_distances, cached=-1):
+        blocker = np.full(len(origins), -1)
+        for i in ([cached] if cached >= 0 else []) + [i for i in self.unbounded if i != cached]:
+            open_rays = np.flatnonzero(blocker < 0)
+            if render_stats.active is not None:
+                render_stats.active.push_rays(open_rays)
+            blocked = self.objects[i].occludes_batch(origins[open_rays], directions[open_rays],
+                                                     max_distances[open_rays])
+            if render_stats.active is not None:
+                render_stats.active.pop_rays()
+            blocker[open_rays[blocked]] = i
+        open_rays = np.flatnonzero(blocker < 0)
+        if self.bvh is not None and len(open_rays):
+            if render_stats.active is not None:
+                render_stats.active.push_rays(open_rays)
+            prim = self.bvh.any_hit_batch(origins[open_rays], directions[open_rays], max_distances[open_rays],
+                                          self.occludes_leaf_batch)
+            if render_stats.active is not None:
+                render_stats.active.pop_rays()
+            blocked = prim >= 0
+            blocker[open_rays[blocked]] = self.bounded[prim[blocked]]
+        return blocker
+
+    def occludes_leaf_batch(self, prims, origins, directions, max_distances):
+        return np.array([self.objects[self.bounded[i]].occludes_batch(origins, directions, max_distances)
+                         for i in prims])
+
+
+# The objects of an animated scene: every frame moves some of the objects from their pose in objects by a 4x4
+# affine transform. The objects that do not move are used as they are, moved meshes become instances of the same
+# Mesh, so the faces and BVHs of the meshes are only built once for the whole animation.
+# The BVH of the scene is refit to every frame. When refitting made it more than rebuild_ratio times as expensive
+# as it was after it was last built (see BVH.traversal_cost) it is built again.
+class AnimatedScene:
+    def __init__(self, objects, rebuild_ratio=2.0):
+        self.scene = objects if isinstance(objects, Scene) else Scene(objects)
+        self.rebuild_ratio = rebuild_ratio
+        self.current = self.scene
+        self.built_cost = self.get_cost(self.scene)
+        self.rebuilds = 0
+
+    def __len__(self):
+        return len(self.scene)
+
+    @staticmethod
+    def get_cost(scene):
+        return scene.bvh.traversal_cost() if scene.bvh is not None else 0.0
+
+    # Returns the Scene of a frame, transforms maps object indices to their transform. The objects that can be moved
+    # have a transformed(transform) method, a copy of the object with its material moved by the transform.
+    def get_frame(self, transforms):
+        for i in transforms:
+            if not hasattr(self.scene[i], 'transformed'):
+                raise TypeError('{} objects cannot be transformed'.format(type(self.scene[i]).__name__))
+        objects = [obj.transformed(transforms[i]) if i in transforms else obj for i, obj in enumerate(self.scene)]
+        frame = self.current.refit(objects)
+        if self.get_cost(frame) > self.rebuild_ratio * self.built_cost:
+            frame = Scene(objects)
+            self.built_cost = self.get_cost(frame)
+            self.rebuilds += 1
+        self.current = frame
+        return frame
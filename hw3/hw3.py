@@ -1,28 +1,426 @@
 # Pre-requirments
 from helper_classes import *
 import matplotlib.pyplot as plt
+import hashlib
+import json
+import multiprocessing
+import os
+import render_stats
 
 # Render method
 def render_scene(camera, ambient, lights, objects, screen_size, max_depth):
+    if not isinstance(objects, Scene):
+        objects = Scene(objects)
     width, height = screen_size
     ratio = float(width) / height
     screen = (-1, 1 / ratio, 1, -1 / ratio)  # left, top, right, bottom
     image = np.zeros((height, width, 3))
+    stats = render_stats.active
     for i, y in enumerate(np.linspace(screen[1], screen[3], height)):
+        # Every row keeps its own cache of the last occluder of every light
+        shadow_cache = {}
         for j, x in enumerate(np.linspace(screen[0], screen[2], width)):
             pixel = np.array([x, y, 0], dtype=np.float64)
             color = np.zeros(3)
             # This is the main loop where each pixel color is computed
             ray = Ray(camera, pixel - camera)
+            if stats is not None:
+                stats.set_pixels(i * width + j)
+                stats.count_rays('primary')
+                stats.start('intersect')
             current_obj, distance = ray.nearest_intersected_object(objects)
+            if stats is not None:
+                stats.stop()
             if current_obj:
                 hit_point = camera + distance * ray.direction
-                color = get_current_color(ambient, lights, current_obj, objects, ray, hit_point, max_depth, camera)
+                color = get_current_color(ambient, lights, current_obj, objects, ray, hit_point, max_depth, camera,
+                                          shadow_cache=shadow_cache)
             # We clip the values between 0 and 1 so all pixel values will make sense
             image[i, j] = np.clip(color, 0, 1)
     return image
 
 
+# This function returns the x and y coordinates of the pixel centres, the same grid render_scene walks
+def get_screen_coordinates(screen_size):
+    width, height = screen_size
+    ratio = float(width) / height
+    screen = (-1, 1 / ratio, 1, -1 / ratio)  # left, top, right, bottom
+    return np.linspace(screen[0], screen[2], width), np.linspace(screen[1], screen[3], height)
+
+
+# This function returns the screen positions of the pixels in rows x cols as an (N, 3) array
+def get_pixel_positions(screen_size, rows, cols):
+    xs, ys = get_screen_coordinates(screen_size)
+    x, y = np.meshgrid(xs[cols], ys[rows])
+    return np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1)
+
+
+# This function builds the rays from the camera through the given (N, 3) screen positions as (N, 3) arrays of
+# origins and directions
+def get_primary_rays(camera, pixels, dtype=np.float64):
+    origins = np.repeat(np.array(camera, dtype=dtype)[None, :], len(pixels), axis=0)
+    return origins, normalize_rows((pixels - camera).astype(dtype, copy=False))
+
+
+# Traces the rays from the camera through the given (N, 3) screen positions as one packet and returns their colors.
+# pixel_ids are the flat indices (row * width + column) of the pixels, they are only used by the heatmap of
+# render_stats. The rays are traced in the precision dtype, the lights and objects should be in it too (see
+# scene_astype).
+def trace_pixels(camera, ambient, lights, objects, pixels, max_depth, min_weight=0.0, pixel_ids=None,
+                 dtype=np.float64):
+    stats = render_stats.active
+    origins, directions = get_primary_rays(camera, pixels, dtype)
+    if stats is not None:
+        stats.set_pixels(pixel_ids if pixel_ids is not None else np.zeros(len(pixels), dtype=int))
+        stats.count_rays('primary', len(pixels))
+        stats.start('intersect')
+    distance, obj_idx, prim_idx = nearest_intersected_objects(objects, origins, directions)
+    if stats is not None:
+        stats.stop()
+    colors = np.zeros((len(origins), 3), dtype=dtype)
+    hit = obj_idx >= 0
+    if hit.any():
+        hit_points = origins[hit] + distance[hit, None] * directions[hit]
+        if stats is not None:
+            stats.push_rays(np.flatnonzero(hit))
+        colors[hit] = get_current_colors(ambient, lights, objects, MaterialTable(objects, dtype), directions[hit],
+                                         hit_points, obj_idx[hit], prim_idx[hit], max_depth, shadow_cache={},
+                                         min_weight=min_weight)
+        if stats is not None:
+            stats.pop_rays()
+    # We clip the values between 0 and 1 so all pixel values will make sense
+    return np.clip(colors, 0, 1)
+
+
+# Renders the pixels in rows x cols (two slices) with ray packets instead of one ray at a time.
+# view is a 4x4 affine transform that moves the camera together with its screen, None leaves them in place.
+def render_tile(camera, ambient, lights, objects, screen_size, max_depth, rows, cols, min_weight=0.0,
+                dtype=np.float64, view=None):
+    tile_height = len(range(*rows.indices(screen_size[1])))
+    pixel_ids = None
+    if render_stats.active is not None:
+        pixel_ids = np.add.outer(np.arange(screen_size[1])[rows] * screen_size[0],
+                                 np.arange(screen_size[0])[cols]).ravel()
+    pixels = get_pixel_positions(screen_size, rows, cols)
+    if view is not None:
+        camera, pixels = transform_points(view, np.asarray(camera, dtype=np.float64)), transform_points(view, pixels)
+    colors = trace_pixels(camera, ambient, lights, objects, pixels, max_depth, min_weight, pixel_ids, dtype)
+    return colors.reshape(tile_height, -1, 3)
+
+
+# This function splits the screen into square tiles of tile_size pixels, every tile is a (rows, cols) pair of slices
+def get_tiles(screen_size, tile_size):
+    width, height = screen_size
+    return [(slice(top, top + tile_size), slice(left, left + tile_size))
+            for top in range(0, height, tile_size) for left in range(0, width, tile_size)]
+
+
+# This function returns copies of the lights and objects (a Scene) in another precision for the batched render
+# methods, float64 ones are returned as they are
+def scene_astype(lights, objects, dtype):
+    if np.dtype(dtype) == np.float64:
+        return lights, objects
+    if isinstance(lights, LightSet):
+        return lights.astype(dtype), objects.astype(dtype)
+    return [light.astype(dtype) for light in lights], objects.astype(dtype)
+
+
+# Batched render method, produces the same image as render_scene.
+# The image is rendered in square tiles of tile_size pixels to bound the size of the ray arrays.
+# Reflected rays whose weight drops to min_weight or below are not traced (0 keeps all of them).
+# With dtype=np.float32 the whole render (scene, rays and colors) is done in single precision, which halves the
+# memory traffic of the ray arrays. Most pixels are then within about 2e-5 of the float64 image, but the ~0.1% that
+# lie on a shadow, reflection or silhouette edge can land on its other side and be off by a few 1e-2.
+def render_scene_batched(camera, ambient, lights, objects, screen_size, max_depth, tile_size=64, min_weight=0.0,
+                         dtype=np.float64):
+    if not isinstance(objects, Scene):
+        objects = Scene(objects)
+    lights, objects = scene_astype(lights, objects, dtype)
+    width, height = screen_size
+    image = np.zeros((height, width, 3), dtype=dtype)
+    for rows, cols in get_tiles(screen_size, tile_size):
+        image[rows, cols] = render_tile(camera, ambient, lights, objects, screen_size, max_depth, rows, cols,
+                                        min_weight, dtype)
+    return image
+
+
+# The scene of the render worker processes, it is sent once to every worker by the pool initializer
+# instead of being pickled with every tile.
+_worker_scene = None
+
+
+def _init_render_worker(scene):
+    global _worker_scene
+    _worker_scene = scene
+
+
+def _render_worker_tile(tile):
+    return render_scene_tile(_worker_scene, tile)
+
+
+# Renders one (rows, cols) tile of a scene tuple (camera, ambient, lights, objects, screen_size, max_depth,
+# min_weight, dtype) and returns rows, cols and the tile
+def render_scene_tile(scene, tile):
+    rows, cols = tile
+    camera, ambient, lights, objects, screen_size, max_depth, min_weight, dtype = scene
+    return rows, cols, render_tile(camera, ambient, lights, objects, screen_size, max_depth, rows, cols, min_weight,
+                                   dtype)
+
+
+# This function renders the tiles of a scene tuple and yields (rows, cols, tile) as they are finished, in the order
+# of tiles with workers=1 and as they come from a pool of worker processes otherwise
+def iter_rendered_tiles(scene, tiles, workers):
+    if workers == 1:
+        for tile in tiles:
+            yield render_scene_tile(scene, tile)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=(scene,)) as pool:
+        yield from pool.imap_unordered(_render_worker_tile, tiles)
+
+
+# Parallel render method, the tiles of render_scene_batched are rendered on a pool of worker processes
+# (workers=None uses all the cores). Every tile is computed exactly as in render_scene_batched with the same
+# tile_size, so the image is bit-identical to it.
+def render_scene_parallel(camera, ambient, lights, objects, screen_size, max_depth, tile_size=64, workers=None,
+                          min_weight=0.0, dtype=np.float64):
+    if not isinstance(objects, Scene):
+        objects = Scene(objects)
+    lights, objects = scene_astype(lights, objects, dtype)
+    width, height = screen_size
+    image = np.zeros((height, width, 3), dtype=dtype)
+    scene = (camera, ambient, lights, objects, screen_size, max_depth, min_weight, dtype)
+    for rows, cols, tile in iter_rendered_tiles(scene, get_tiles(screen_size, tile_size), workers):
+        image[rows, cols] = tile
+    return image
+
+
+# Out-of-core render method for images bigger than memory and renders that may be interrupted.
+# The image is a .npy file at path that is memory mapped, every finished tile is written into it and flushed to
+# disk, and then its index is appended to the checkpoint file path + '.tiles'. Calling it again with the same path
+# resumes the render: the tiles listed in the checkpoint are not rendered again. The tiles are rendered as in
+# render_scene_parallel (workers=1 renders them in this process), so the image is the same.
+# The checkpoint starts with a header of the camera, the sizes, the dtype and a hash of the rest of the scene (see
+# render_hash), a render that differs in any of them is refused instead of being resumed.
+# Returns the image memory mapped read-only.
+def render_scene_to_file(camera, ambient, lights, objects, screen_size, max_depth, path, tile_size=64, workers=1,
+                         min_weight=0.0, dtype=np.float64):
+    if not isinstance(objects, Scene):
+        objects = Scene(objects)
+    width, height = screen_size
+    tiles = get_tiles(screen_size, tile_size)
+    checkpoint_path = path + '.tiles'
+    header = {'screen_size': [width, height], 'tile_size': tile_size, 'dtype': np.dtype(dtype).str,
+              'camera': [float(x) for x in camera],
+              'scene': render_hash(ambient, lights, objects, max_depth, min_weight)}
+    done = read_checkpoint(checkpoint_path, header) if os.path.exists(path) else None
+    if done is None:
+        image = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(height, width, 3))
+        with open(checkpoint_path, 'w') as checkpoint:
+            checkpoint.write(json.dumps(header) + '\n')
+        done = set()
+    else:
+        image = np.lib.format.open_memmap(path, mode='r+')
+
+    lights, objects = scene_astype(lights, objects, dtype)
+    tile_index = {(rows.start, cols.start): i for i, (rows, cols) in enumerate(tiles)}
+    scene = (camera, ambient, lights, objects, screen_size, max_depth, min_weight, dtype)
+    todo = [tile for i, tile in enumerate(tiles) if i not in done]
+    with open(checkpoint_path, 'a') as checkpoint:
+        for rows, cols, tile in iter_rendered_tiles(scene, todo, workers):
+            image[rows, cols] = tile
+            # The tile is on disk before the checkpoint says so
+            image.flush()
+            checkpoint.write('{}\n'.format(tile_index[rows.start, cols.start]))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+    del image
+    return np.load(path, mmap_mode='r')
+
+
+# This function returns the indices of the finished tiles of a checkpoint file, None if there is no checkpoint.
+# A checkpoint of a render with another header (scene, camera, size, tile size or dtype) cannot be resumed.
+def read_checkpoint(checkpoint_path, header):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as checkpoint:
+        lines = checkpoint.read().split('\n')
+    # A header cut by the interruption cannot be matched to the render, it is refused like the header of another one
+    try:
+        matches = json.loads(lines[0]) == header
+    except json.JSONDecodeError:
+        matches = False
+    if not matches:
+        raise ValueError('{} belongs to a render with {}, not {}'.format(checkpoint_path, lines[0], json.dumps(header)))
+    # The last line may have been cut by the interruption, it is only complete if a newline follows it
+    return {int(line) for line in lines[1:-1] if line.strip()}
+
+
+# A hash of what a render sees of the scene besides the camera and the sizes: the ambient light, the lights, the
+# objects and the render settings. Objects and lights are hashed by their attributes, the arrays by their content.
+# Dicts and BVHs are left out, they are caches (the triangles of a mesh, its copies in other precisions) or built from
+# the objects.
+def render_hash(ambient, lights, objects, max_depth, min_weight):
+    digest = hashlib.sha256()
+    update_hash(digest, [ambient, lights, objects, max_depth, min_weight], set())
+    return digest.hexdigest()
+
+
+def update_hash(digest, value, seen):
+    if isinstance(value, np.ndarray):
+        digest.update('{} {}'.format(value.dtype.str, value.shape).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update('[{}'.format(len(value)).encode())
+        for item in value:
+            update_hash(digest, item, seen)
+    elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+        digest.update(repr(value).encode())
+    elif hasattr(value, '__dict__') and id(value) not in seen:
+        # Objects shared by others (the mesh of its instances) are hashed once
+        seen.add(id(value))
+        digest.update(type(value).__name__.encode())
+        for name, attr in sorted(vars(value).items()):
+            if not isinstance(attr, (dict, BVH)):
+                digest.update(name.encode())
+                update_hash(digest, attr, seen)
+
+
+# Sequence render method for animations such as turntables and fly-throughs.
+# frames is a list of dicts, one per frame, with the optional keys 'camera' (the camera position, camera by default),
+# 'view' (a 4x4 transform of the camera and its screen, see orbit_frames) and 'transforms' (a dict of object index
+# to the 4x4 transform that moves it from its pose in objects). The objects are kept in an AnimatedScene, so the
+# static objects and the meshes are set up once and the BVH of the scene is refit to every frame instead of being
+# built again.
+# The frames are rendered tile by tile as in render_scene_parallel (workers=1 renders them in this process, the
+# scene is sent once to every worker) and yielded as (frame index, image) in order, each as soon as it is done.
+def iter_sequence_frames(camera, ambient, lights, objects, screen_size, max_depth, frames, tile_size=64, workers=1,
+                         min_weight=0.0, dtype=np.float64, rebuild_ratio=2.0):
+    animated = AnimatedScene(objects, rebuild_ratio)
+    lights, _ = scene_astype(lights, animated.scene, dtype)
+    width, height = screen_size
+    tiles = get_tiles(screen_size, tile_size)
+    scene = (camera, ambient, lights, animated, screen_size, max_depth, min_weight, dtype)
+    tasks = [(index, frame, tile) for index, frame in enumerate(frames) for tile in tiles]
+    image, done = None, 0
+    for index, rows, cols, tile in iter_sequence_tiles(scene, tasks, workers):
+        if image is None:
+            image = np.zeros((height, width, 3), dtype=dtype)
+        image[rows, cols] = tile
+        done += 1
+        if done == len(tiles):
+            yield index, image
+            image, done = None, 0
+
+
+# Renders the sequence into image files (or .npy files) named path.format(frame index), for example
+# 'frames/frame{:04d}.png'. Every frame is written as soon as it is done. Returns the paths of the frames.
+def render_sequence(camera, ambient, lights, objects, screen_size, max_depth, frames, path, tile_size=64, workers=1,
+                    min_weight=0.0, dtype=np.float64, rebuild_ratio=2.0):
+    paths = []
+    for index, image in iter_sequence_frames(camera, ambient, lights, objects, screen_size, max_depth, frames,
+                                             tile_size, workers, min_weight, dtype, rebuild_ratio):
+        frame_path = path.format(index)
+        if os.path.dirname(frame_path):
+            os.makedirs(os.path.dirname(frame_path), exist_ok=True)
+        if frame_path.endswith('.npy'):
+            np.save(frame_path, image)
+        else:
+            plt.imsave(frame_path, image)
+        paths.append(frame_path)
+    return paths
+
+
+# The frames of a turntable: the camera circles count times around center in steps of 2 pi / count, turning about
+# axis
+def orbit_frames(count, center, axis=(0, 1, 0)):
+    center = np.array(center, dtype=np.float64)
+    return [{'view': translation_matrix(center) @ rotation_matrix(axis, 2 * np.pi * i / count) @
+             translation_matrix(-center)} for i in range(count)]
+
+
+# The frame the worker processes are rendering: its index and its objects, the tiles of a frame come one after the
+# other so its objects are only made once per worker
+_worker_frame = {}
+
+
+def _render_worker_frame_tile(task):
+    return render_sequence_tile(_worker_scene, _worker_frame, task)
+
+
+# Renders one tile of a frame, task is (frame index, frame, tile). frame_cache keeps the objects of the last frame.
+# Returns the frame index, rows, cols and the tile.
+def render_sequence_tile(scene, frame_cache, task):
+    index, frame, (rows, cols) = task
+    camera, ambient, lights, animated, screen_size, max_depth, min_weight, dtype = scene
+    if frame_cache.get('index') != index:
+        objects = animated.get_frame(frame.get('transforms', {}))
+        frame_cache.update(index=index, objects=objects if np.dtype(dtype) == np.float64 else objects.astype(dtype))
+    return index, rows, cols, render_tile(frame.get('camera', camera), ambient, lights, frame_cache['objects'],
+                                          screen_size, max_depth, rows, cols, min_weight, dtype, frame.get('view'))
+
+
+# This function renders the (frame index, frame, tile) tasks of a sequence in order and yields
+# (frame index, rows, cols, tile), in this process with workers=1 and on a pool of worker processes otherwise
+def iter_sequence_tiles(scene, tasks, workers):
+    if workers == 1:
+        frame_cache = {}
+        for task in tasks:
+            yield render_sequence_tile(scene, frame_cache, task)
+        return
+    with multiprocessing.Pool(workers, initializer=_init_render_worker, initargs=(scene,)) as pool:
+        yield from pool.imap(_render_worker_frame_tile, tasks)
+
+
+# Progressive render method, a generator that yields a better image after every pass.
+# The first pass is the 1 sample per pixel image of render_scene_batched. Every following pass adds
+# samples_per_pass jittered samples, but only to the pixels whose color differs from one of their neighbours or
+# whose samples vary by more than threshold. Rendering stops after passes passes or when no pixel needs more samples.
+def render_scene_progressive(camera, ambient, lights, objects, screen_size, max_depth, passes=4, samples_per_pass=4,
+                             threshold=0.05, tile_size=64, seed=None):
+    if not isinstance(objects, Scene):
+        objects = Scene(objects)
+    width, height = screen_size
+    image = render_scene_batched(camera, ambient, lights, objects, screen_size, max_depth, tile_size)
+    yield image
+    total, total_sq = image.copy(), image ** 2
+    count = np.ones((height, width))
+    xs, ys = get_screen_coordinates(screen_size)
+    pixel_width = (xs[-1] - xs[0]) / max(width - 1, 1)
+    pixel_height = (ys[0] - ys[-1]) / max(height - 1, 1)
+    rng = np.random.default_rng(seed)
+    for _ in range(passes - 1):
+        mean = total / count[:, :, None]
+        variance = np.max(total_sq / count[:, :, None] - mean ** 2, axis=2)
+        refine = (get_neighbour_contrast(mean) > threshold) | (np.sqrt(np.maximum(variance, 0)) > threshold)
+        rows, cols = np.nonzero(refine)
+        if not len(rows):
+            break
+        rows, cols = np.repeat(rows, samples_per_pass), np.repeat(cols, samples_per_pass)
+        jitter = rng.uniform(-0.5, 0.5, (len(rows), 2))
+        pixels = np.stack([xs[cols] + jitter[:, 0] * pixel_width, ys[rows] + jitter[:, 1] * pixel_height,
+                           np.zeros(len(rows))], axis=1)
+        for start in range(0, len(pixels), tile_size * tile_size):
+            chunk = slice(start, start + tile_size * tile_size)
+            colors = trace_pixels(camera, ambient, lights, objects, pixels[chunk], max_depth,
+                                  pixel_ids=rows[chunk] * width + cols[chunk])
+            np.add.at(total, (rows[chunk], cols[chunk]), colors)
+            np.add.at(total_sq, (rows[chunk], cols[chunk]), colors ** 2)
+            np.add.at(count, (rows[chunk], cols[chunk]), 1)
+        yield total / count[:, :, None]
+
+
+# This function returns for every pixel the largest color difference to its 4 neighbours
+def get_neighbour_contrast(image):
+    contrast = np.zeros(image.shape[:2])
+    vertical = np.max(np.abs(image[1:] - image[:-1]), axis=2)
+    horizontal = np.max(np.abs(image[:, 1:] - image[:, :-1]), axis=2)
+    contrast[1:] = np.maximum(contrast[1:], vertical)
+    contrast[:-1] = np.maximum(contrast[:-1], vertical)
+    contrast[:, 1:] = np.maximum(contrast[:, 1:], horizontal)
+    contrast[:, :-1] = np.maximum(contrast[:, :-1], horizontal)
+    return contrast
+
+
 # Write your own objects and lights
 def your_own_scene():
     camera = np.array([0, 0, 1])
@@ -0,0 +1,216 @@
+# Pre-requirments
+import os
+import numpy as np
+from helper_classes import Mesh
+
+# Number of lines (OBJ, ASCII PLY) or records (binary PLY) that are parsed at once
+CHUNK_SIZE = 1 << 16
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+
+# A NumPy array that grows by doubling its capacity, chunks are written straight into it
+class ArrayBuffer:
+    def __init__(self, columns, dtype, capacity=CHUNK_SIZE):
+        self.data = np.empty((capacity, columns), dtype=dtype)
+        self.size = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.data.dtype).reshape(-1, self.data.shape[1])
+        needed = self.size + len(rows)
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            grown = np.empty((capacity, self.data.shape[1]), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = rows
+        self.size = needed
+
+    def array(self):
+        return self.data[:self.size]
+
+
+# This function splits a polygon given by its vertex indices into a fan of triangles
+def triangulate(polygon):
+    return [(polygon[0], polygon[i], polygon[i + 1]) for i in range(1, len(polygon) - 1)]
+
+
+# Reads an OBJ file chunk by chunk and returns the (V, 3) vertex and (F, 3) face arrays.
+# Polygons are triangulated, texture and normal indices (v/vt/vn) are ignored and negative indices are resolved.
+def read_obj(path, chunk_size=CHUNK_SIZE):
+    vertices = ArrayBuffer(3, np.float64)
+    faces = ArrayBuffer(3, np.int64)
+    with open(path) as f:
+        while True:
+            lines = f.readlines(chunk_size * 32)
+            if not lines:
+                break
+            v_rows, f_rows = [], []
+            for line in lines:
+                if line.startswith('v '):
+                    v_rows.append(line.split()[1:4])
+                elif line.startswith('f '):
+                    polygon = [int(token.split('/')[0]) for token in line.split()[1:]]
+                    polygon = [i - 1 if i > 0 else vertices.size + len(v_rows) + i for i in polygon]
+                    f_rows += triangulate(polygon)
+            # Vertices are flushed first so negative face indices of the next chunk see them
+            vertices.append(np.array(v_rows, dtype=np.float64))
+            faces.append(np.array(f_rows, dtype=np.int64))
+    return vertices.array(), faces.array()
+
+
+# This function reads a PLY header and returns its format, a list of (name, count, properties) elements and
+# the size of the header in bytes. A property is a (name, type) pair, or (name, count type, item type) for a list.
+def read_ply_header(f):
+    if f.readline().strip() != b'ply':
+        raise ValueError('not a PLY file')
+    fmt, elements = None, []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('PLY header has no end_header')
+        words = line.decode('ascii').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'format':
+            fmt = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property':
+            if words[1] == 'list':
+                elements[-1][2].append((words[4], PLY_TYPES[words[2]], PLY_TYPES[words[3]]))
+            else:
+                elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+        elif words[0] == 'end_header':
+            return fmt, elements, f.tell()
+
+
+# The structured dtype of an element without list properties, None if it has lists
+def ply_record_dtype(properties, byte_order):
+    if any(len(p) == 3 for p in properties):
+        return None
+    return np.dtype([(name, byte_order + t) for name, t in properties])
+
+
+# Reads a PLY file (ascii, binary_little_endian or binary_big_endian) and returns the vertex and face arrays.
+# With mmap=True the binary vertex block is memory mapped instead of read, and when every face is a triangle the
+# faces are mapped too: the returned arrays are then views of the file (np.memmap) with no copy made.
+def read_ply(path, mmap=True, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        fmt, elements, offset = read_ply_header(f)
+        if fmt == 'ascii':
+            return read_ply_ascii(f, elements, chunk_size)
+    byte_order = '<' if fmt == 'binary_little_endian' else '>'
+    vertices, faces = None, None
+    for name, count, properties in elements:
+        record = ply_record_dtype(properties, byte_order)
+        if record is not None:
+            data = np.memmap(path, dtype=record, mode='r', offset=offset, shape=(count,))
+            offset += record.itemsize * count
+            if name == 'vertex':
+                vertices = ply_vertex_view(data, record, mmap)
+        elif name == 'face':
+            faces, offset = read_ply_faces(path, offset, count, properties, byte_order, mmap, chunk_size)
+        else:
+            offset = skip_ply_lists(path, offset, count, properties, byte_order)
+    return vertices, faces
+
+
+# Returns the x, y, z columns of a vertex block as a (V, 3) array. When the block holds nothing but x, y, z of one
+# type this is a view of the memory mapped file, otherwise the columns are copied.
+def ply_vertex_view(data, record, mmap):
+    names = [record.names[i] for i in range(min(3, len(record.names)))]
+    if mmap and names == ['x', 'y', 'z'] and len(record.names) == 3 and len(set(
+            record.fields[n][0] for n in names)) == 1:
+        return data.view(record.fields['x'][0]).reshape(-1, 3)
+    vertices = np.empty((len(data), 3), dtype=np.float64)
+    for start in range(0, len(data), CHUNK_SIZE):
+        chunk = data[start:start + CHUNK_SIZE]
+        vertices[start:start + len(chunk)] = np.stack([chunk['x'], chunk['y'], chunk['z']], axis=1)
+    return vertices
+
+
+# Reads the face element of a binary PLY. Faces are first mapped as triangles, which holds for most files,
+# otherwise the records are walked one chunk at a time and triangulated.
+def read_ply_faces(path, offset, count, properties, byte_order, mmap, chunk_size):
+    (_, count_type, item_type), = [p for p in properties if len(p) == 3]
+    if len(properties) == 1:
+        triangle = np.dtype([('n', byte_order + count_type), ('i', byte_order + item_type, 3)])
+        if offset + triangle.itemsize * count <= os.path.getsize(path):
+            data = np.memmap(path, dtype=triangle, mode='r', offset=offset, shape=(count,))
+            if np.all(data['n'] == 3):
+                faces = data['i'] if mmap else np.array(data['i'], dtype=np.int64)
+                return faces, offset + triangle.itemsize * count
+    faces = ArrayBuffer(3, np.int64)
+    rows = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for record in walk_ply_lists(f, count, properties, byte_order):
+            rows += triangulate(record)
+            if len(rows) >= chunk_size:
+                faces.append(rows)
+                rows = []
+        offset = f.tell()
+    faces.append(rows)
+    return faces.array(), offset
+
+
+# Walks the records of an element that has list properties from the current position of the file f,
+# and yields the items of the (last) list of every record
+def walk_ply_lists(f, count, properties, byte_order):
+    for _ in range(count):
+        items = None
+        for p in properties:
+            if len(p) == 3:
+                count_dtype, item_dtype = np.dtype(byte_order + p[1]), np.dtype(byte_order + p[2])
+                n = int(np.frombuffer(f.read(count_dtype.itemsize), count_dtype)[0])
+                items = np.frombuffer(f.read(item_dtype.itemsize * n), item_dtype).tolist()
+            else:
+                f.seek(np.dtype(p[1]).itemsize, 1)
+        yield items
+
+
+def skip_ply_lists(path, offset, count, properties, byte_order):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for _ in walk_ply_lists(f, count, properties, byte_order):
+            pass
+        return f.tell()
+
+
+def read_ply_ascii(f, elements, chunk_size):
+    vertices = ArrayBuffer(3, np.float64)
+    faces = ArrayBuffer(3, np.int64)
+    for name, count, properties in elements:
+        names = [p[0] for p in properties]
+        remaining = count
+        while remaining:
+            lines = [f.readline() for _ in range(min(chunk_size, remaining))]
+            remaining -= len(lines)
+            if name == 'vertex':
+                rows = [line.split() for line in lines]
+                vertices.append(np.array([[r[names.index(c)] for c in 'xyz'] for r in rows], dtype=np.float64))
+            elif name == 'face':
+                rows = []
+                for line in lines:
+                    values = [int(float(v)) for v in line.split()]
+                    rows += triangulate(values[1:1 + values[0]])
+                faces.append(rows)
+    return vertices.array(), faces.array()
+
+
+# Loads an OBJ or PLY file into a Mesh. mmap only applies to binary PLY files (see read_ply), OBJ files are parsed.
+def load_mesh(path, mmap=True, chunk_size=CHUNK_SIZE):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.obj':
+        v_list, f_list = read_obj(path, chunk_size)
+    elif ext == '.ply':
+        v_list, f_list = read_ply(path, mmap, chunk_size)
+    else:
+        raise ValueError('unsupported mesh format: ' + ext)
+    return Mesh(v_list, f_list)
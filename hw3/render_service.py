@@ -0,0 +1,315 @@
+# Pre-requirments
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scene_io
+
+# A local render service. Render jobs are POSTed as JSON to /render over HTTP (TCP or a Unix socket):
+#   {"scene": "scenes/scene3.json", "screen_size": [96, 64], "format": "png"}
+# "scene" is the path of a scene file (relative to the scene root of the service) or a scene description itself
+# (see scene_io), "camera", "ambient", "screen_size" and "max_depth" replace the ones of the scene and "format" is
+# "png" (the default) or "npy". The answer is the rendered image, its X-Cache header tells if it came from the
+# result cache ("hit"), was rendered for this job ("miss") or was rendered for an identical job that was already
+# running ("joined"). GET /stats returns the counters of the service as JSON.
+#
+# Usage (from the hw3 directory):
+#   python render_service.py --port 8765 --cache-size 256
+#   python render_service.py --unix-socket /tmp/render.sock
+
+SERVICE_VERSION = 1
+CONTENT_TYPES = {'png': 'image/png', 'npy': 'application/octet-stream'}
+REPLACEABLE = ('camera', 'ambient', 'screen_size', 'max_depth')
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+# The rendered images on disk, one file per result named by its key, with the least recently used ones deleted
+# when they take more than max_bytes together. The order of use is kept in the modification times of the files,
+# so it survives a restart of the service. get and put are called from threads, a lock keeps the index consistent.
+class ResultCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # File name -> size, the least recently used first
+        self.entries = OrderedDict()
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.')]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+        self.size = sum(self.entries.values())
+        self.evict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.entries:
+                return None
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                self.size -= self.entries.pop(name)
+                return None
+            self.entries.move_to_end(name)
+            return data
+
+    # The file is written under a temporary name and renamed, so a half written result is never read
+    def put(self, name, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            os.replace(tmp, os.path.join(self.directory, name))
+            self.size += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+# This function turns a request into a job: the scene description with the replaced settings, the directory its
+# mesh paths are relative to and the output format. Scene files and the mesh files of the scene must be inside
+# scene_root.
+def read_job(request, scene_root):
+    if not isinstance(request, dict):
+        raise ValueError('a render request is a JSON object')
+    scene = request.get('scene')
+    root = os.path.realpath(scene_root)
+    if isinstance(scene, str):
+        path = resolve_inside(root, root, scene, 'scene files')
+        description, base_dir = scene_io.read_scene_description(path), os.path.dirname(path)
+    elif isinstance(scene, dict):
+        description, base_dir = scene, root
+    else:
+        raise ValueError('"scene" must be the path of a scene file or a scene description')
+    for obj in list(description.get('objects', [])) + list(description.get('meshes', {}).values()):
+        if 'path' in obj:
+            resolve_inside(root, base_dir, obj['path'], 'mesh files')
+    description = dict(description)
+    for name in REPLACEABLE:
+        if name in request:
+            description[name] = request[name]
+    output_format = request.get('format', 'png')
+    if output_format not in CONTENT_TYPES:
+        raise ValueError('unknown format: {}, use one of {}'.format(output_format, ', '.join(CONTENT_TYPES)))
+    return {'description': description, 'base_dir': base_dir, 'format': output_format}
+
+
+# Returns the real path of path (relative to base_dir), or raises ValueError if it is outside root. Symbolic links
+# are followed, so neither "..", an absolute path nor a link can reach a file outside root.
+def resolve_inside(root, base_dir, path, what):
+    resolved = os.path.realpath(os.path.join(base_dir, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError('{} must be inside {}'.format(what, root))
+    return resolved
+
+
+# The key of the result of a job: a hash of the whole scene description, the contents of its mesh files and the
+# output format. Identical jobs have the same key however their scene was given.
+def job_key(job):
+    digest = hashlib.sha256('render service {}'.format(SERVICE_VERSION).encode())
+    digest.update(scene_io.scene_hash(job['description'], job['base_dir']).encode())
+    digest.update(json.dumps([job['description'], job['format']], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# Renders a job in a worker process and returns the encoded image.
+# The meshes and BVHs of the scene are kept in the scene cache of scene_io when use_scene_cache is set.
+def render_job(job, use_scene_cache=True):
+    import hw3
+    scene = scene_io.make_scene(job['description'], job['base_dir'], use_cache=use_scene_cache)
+    image = hw3.render_scene_batched(**scene)
+    buffer = io.BytesIO()
+    if job['format'] == 'npy':
+        np.save(buffer, image)
+    else:
+        hw3.plt.imsave(buffer, image, format='png')
+    return buffer.getvalue()
+
+
+# The service: jobs are rendered on a pool of worker processes (workers=None uses all the cores) with the
+# batched render method, which gives the image of render_scene. Identical jobs that arrive while one of them is
+# being rendered wait for its result instead of being rendered again.
+class RenderService:
+    def __init__(self, cache, workers=None, scene_root='.', use_scene_cache=True):
+        self.cache = cache
+        self.scene_root = scene_root
+        self.use_scene_cache = use_scene_cache
+        # Forked workers would inherit the sockets of the connections that are open when they start and keep them
+        # open after the service closed them, so they are spawned
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        # Result file name -> the future of the render that produces it
+        self.in_flight = {}
+        self.counts = Counter()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def stats(self):
+        return {'hit': self.counts['hit'], 'miss': self.counts['miss'], 'joined': self.counts['joined'],
+                'failed': self.counts['failed'], 'in_flight': len(self.in_flight), 'cached_results': len(self.cache),
+                'cache_bytes': self.cache.size}
+
+    # Returns the encoded image of a request, its format and where it came from ('hit', 'miss' or 'joined')
+    async def render(self, request):
+        loop = asyncio.get_running_loop()
+        job = read_job(request, self.scene_root)
+        # Hashing reads the mesh files, it is done on a thread so the other connections are not held up
+        name = '{}.{}'.format(await loop.run_in_executor(None, job_key, job), job['format'])
+        data = await loop.run_in_executor(None, self.cache.get, name)
+        if data is not None:
+            self.counts['hit'] += 1
+            return data, job['format'], 'hit'
+        source = 'joined' if name in self.in_flight else 'miss'
+        self.counts[source] += 1
+        if source == 'miss':
+            future = loop.run_in_executor(self.executor, render_job, job, self.use_scene_cache)
+            future.add_done_callback(lambda done: self.finish(name, done))
+            self.in_flight[name] = future
+        # A client that goes away does not cancel the render the other ones wait for
+        return await asyncio.shield(self.in_flight[name]), job['format'], source
+
+    # The result is written to the cache on a thread, the render stays in flight until it is there so an identical
+    # job that arrives meanwhile joins it instead of missing the cache
+    def finish(self, name, future):
+        if future.cancelled():
+            del self.in_flight[name]
+            return
+        if future.exception() is not None:
+            del self.in_flight[name]
+            self.counts['failed'] += 1
+            return
+        saved = future.get_loop().run_in_executor(None, self.cache.put, name, future.result())
+        saved.add_done_callback(lambda _: self.in_flight.pop(name))
+
+    # One HTTP/1.1 exchange per connection: the request is read, answered and the connection is closed
+    async def handle(self, reader, writer):
+        try:
+            status, headers, body = await self.respond(reader)
+        except (ValueError, KeyError, TypeError, FileNotFoundError) as e:
+            status, headers, body = error_response(400, e)
+        except Exception as e:
+            status, headers, body = error_response(500, e)
+        head = ['HTTP/1.1 {} {}'.format(status, STATUS_TEXT[status]), 'Content-Length: {}'.format(len(body)),
+                'Connection: close'] + ['{}: {}'.format(key, value) for key, value in headers.items()]
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def respond(self, reader):
+        method, target, _ = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        if method == 'GET' and target == '/stats':
+            return 200, {'Content-Type': 'application/json'}, json.dumps(self.stats()).encode()
+        if method == 'POST' and target == '/render':
+            data, output_format, source = await self.render(json.loads(body))
+            return 200, {'Content-Type': CONTENT_TYPES[output_format], 'X-Cache': source}, data
+        return error_response(404, '{} {} is not served'.format(method, target))
+
+    # Serves until SIGINT or SIGTERM
+    async def serve(self, host='127.0.0.1', port=8765, unix_socket=None):
+        loop = asyncio.get_running_loop()
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle, unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+            except NotImplementedError:
+                # Windows, Ctrl+C still raises KeyboardInterrupt
+                pass
+        try:
+            async with server:
+                await stop
+        finally:
+            if unix_socket is not None and os.path.exists(unix_socket):
+                os.remove(unix_socket)
+
+
+def error_response(status, error):
+    return status, {'Content-Type': 'application/json'}, json.dumps({'error': str(error)}).encode()
+
+
+# A blocking client for scripts and notebooks, it sends one render request and returns the body of the answer and
+# its headers. Raises RuntimeError with the message of the service when the job failed.
+def request_render(request, host='127.0.0.1', port=8765, unix_socket=None, timeout=None):
+    body = json.dumps(request).encode()
+    head = 'POST /render HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n' \
+           'Connection: close\r\n\r\n'.format(host, len(body))
+    if unix_socket is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(unix_socket)
+    else:
+        connection = socket.create_connection((host, port), timeout)
+    with connection:
+        connection.sendall(head.encode() + body)
+        response = b''.join(iter(lambda: connection.recv(1 << 16), b''))
+    head, _, data = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {key.strip().lower(): value.strip() for key, _, value in (line.partition(':') for line in lines[1:])}
+    if status != 200:
+        raise RuntimeError('render failed ({}): {}'.format(status, json.loads(data).get('error')))
+    return data, headers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve hw3 renders over HTTP with a cache of the results.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix-socket', help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--cache-dir', default='.render_cache', help='the directory of the result cache')
+    parser.add_argument('--cache-size', type=float, default=256, help='the size of the result cache in MB')
+    parser.add_argument('--workers', type=int, help='the number of render processes, all the cores by default')
+    parser.add_argument('--scene-root', default='.', help='scene file paths are relative to this directory')
+    parser.add_argument('--no-scene-cache', action='store_true', help='do not keep meshes and BVHs in .scene_cache')
+    args = parser.parse_args(argv)
+
+    service = RenderService(ResultCache(args.cache_dir, int(args.cache_size * 2 ** 20)), args.workers,
+                            args.scene_root, not args.no_scene_cache)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
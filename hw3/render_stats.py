@@ -0,0 +1,105 @@
+# Pre-requirments
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# The RenderStats that the ray tracer reports to, None when instrumentation is off.
+# Every instrumented call site only checks this for None, so a render without stats pays next to nothing.
+active = None
+
+
+# Counters and timers of one render.
+# rays counts the traced rays by type ('primary', 'shadow', 'reflection') and tests the intersection tests by
+# primitive class ('Sphere', 'Plane', 'Triangle' and 'BVHNode' for the bounding box tests of the BVH traversal).
+# times holds the seconds spent in the 'intersect' (nearest hit of the primary rays), 'shade' (ambient and direct
+# light with its shadow rays) and 'reflect' (tracing the reflected rays) phases. The phases are exclusive: the time
+# of a phase that starts inside another one is not counted twice.
+# With a screen_size the intersection tests are also added up per pixel into heatmap.
+class RenderStats:
+    def __init__(self, screen_size=None):
+        self.rays = Counter()
+        self.tests = Counter()
+        self.times = defaultdict(float)
+        self.heatmap = None
+        if screen_size is not None:
+            width, height = screen_size
+            self.heatmap = np.zeros((height, width))
+        # The flat pixel index of every ray of the queries being traced, nested queries push the subset of rays
+        # they trace
+        self.ray_pixels = []
+        self.phases = []
+        self.phase_start = 0.0
+
+    def __repr__(self):
+        return 'RenderStats(rays={}, tests={}, times={})'.format(
+            dict(self.rays), dict(self.tests), {phase: round(t, 4) for phase, t in self.times.items()})
+
+    def count_rays(self, kind, n=1):
+        self.rays[kind] += n
+
+    # n_rays rays were tested against tests_per_ray primitives of the class kind each. rays selects them from the
+    # rays of the current query, all of them by default.
+    def count_tests(self, kind, n_rays, tests_per_ray=1, rays=None):
+        self.tests[kind] += n_rays * tests_per_ray
+        if self.heatmap is not None and self.ray_pixels:
+            pixels = self.ray_pixels[-1] if rays is None else self.ray_pixels[-1][rays]
+            np.add.at(self.heatmap.reshape(-1), pixels, tests_per_ray)
+
+    # The rays of the next queries belong to these flat pixel indices (row * width + column)
+    def set_pixels(self, pixels):
+        self.ray_pixels = [np.atleast_1d(pixels)]
+
+    def push_rays(self, rays):
+        if self.ray_pixels:
+            self.ray_pixels.append(self.ray_pixels[-1][rays])
+
+    def pop_rays(self):
+        if len(self.ray_pixels) > 1:
+            self.ray_pixels.pop()
+
+    def start(self, phase):
+        now = time.perf_counter()
+        if self.phases:
+            self.times[self.phases[-1]] += now - self.phase_start
+        self.phases.append(phase)
+        self.phase_start = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self.times[self.phases.pop()] += now - self.phase_start
+        self.phase_start = now
+
+    def summary(self):
+        return {
+            'rays': dict(self.rays),
+            'total_rays': sum(self.rays.values()),
+            'tests': dict(self.tests),
+            'total_tests': sum(self.tests.values()),
+            'times': dict(self.times),
+        }
+
+    # The heatmap scaled to [0, 1] on a log scale, so the few expensive pixels do not hide the rest
+    def heatmap_image(self):
+        cost = np.log1p(self.heatmap)
+        return cost / cost.max() if cost.max() > 0 else cost
+
+    def save_heatmap(self, path, cmap='inferno'):
+        import matplotlib.pyplot as plt
+        plt.imsave(path, self.heatmap_image(), cmap=cmap, vmin=0, vmax=1)
+
+
+# Turns the instrumentation on for the renders inside the with block, for example:
+#     with collect_stats((width, height)) as stats:
+#         image = render_scene(camera, ambient, lights, objects, (width, height), max_depth)
+#     print(stats.summary())
+# Only renders in this process are counted, the workers of render_scene_parallel are not instrumented.
+@contextmanager
+def collect_stats(screen_size=None):
+    global active
+    previous = active
+    active = RenderStats(screen_size)
+    try:
+        yield active
+    finally:
+        active = previous
@@ -0,0 +1,230 @@
+# Pre-requirments
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from bvh import BVH
+from helper_classes import *
+from mesh_io import load_mesh
+
+# Scene files are JSON (or YAML when PyYAML is installed) documents like:
+# {
+#   "camera": [0, 0, 1],
+#   "ambient": [0.1, 0.1, 0.1],
+#   "screen_size": [300, 200],
+#   "max_depth": 3,
+#   "materials": {"green": {"ambient": [0, 0.5, 0], "diffuse": [0, 1, 0], "specular": [1, 1, 1],
+#                           "shininess": 10, "reflection": 0.5}},
+#   "lights": [{"type": "directional", "intensity": [1, 1, 1], "direction": [1, 1, 1]},
+#              {"type": "point", "intensity": [1, 1, 1], "position": [1, 1.5, 1], "kc": 0.1, "kl": 0.1, "kq": 0.1},
+#              {"type": "spot", "intensity": [1, 1, 1], "position": [0, 1, 0], "direction": [0, -1, 0],
+#               "kc": 0.1, "kl": 0.1, "kq": 0.1}],
+#   "objects": [{"type": "plane", "normal": [0, 1, 0], "point": [0, -1, 0], "material": "green"},
+#               {"type": "sphere", "center": [0, 0, -1], "radius": 0.5, "material": {...}},
+#               {"type": "triangle", "a": [...], "b": [...], "c": [...], "material": "green"},
+#               {"type": "mesh", "vertices": [[...], ...], "faces": [[0, 1, 2], ...], "material": "green"},
+#               {"type": "mesh", "path": "bunny.ply", "material": "green"},
+#               {"type": "instance", "mesh": "tree", "transform": [[1, 0, 0, 2], [0, 1, 0, 0], [0, 0, 1, -3],
+#                                                                 [0, 0, 0, 1]], "material": "green"}],
+#   "meshes": {"tree": {"path": "tree.ply"}}
+# }
+# A material is the name of an entry of "materials" or the material itself. Mesh paths are relative to the scene
+# file. The entries of "meshes" are meshes (a path or vertices and faces) that are only placed in the scene by
+# instances, every instance of a mesh shares it. screen_size and max_depth are optional. A scene with many lights
+# can add "light_cutoff" and "light_samples" to get its lights as a LightSet with that cutoff and number of samples.
+
+DEFAULT_SCREEN_SIZE = (300, 200)
+DEFAULT_MAX_DEPTH = 3
+CACHE_DIR_NAME = '.scene_cache'
+# Part of the cache key, changing the layout of the cache makes old entries miss
+CACHE_VERSION = 2
+
+
+def read_scene_description(path):
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is needed to read YAML scene files, use JSON or install pyyaml')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+# The cache key of a scene: a hash of its objects and meshes and of every mesh file they refer to, mesh paths are
+# relative to base_dir. The camera, the lights and the other render settings are left out, they do not change what
+# is cached.
+def scene_hash(description, base_dir):
+    digest = hashlib.sha256('scene cache {}'.format(CACHE_VERSION).encode())
+    geometry = {'objects': description.get('objects', []), 'meshes': description.get('meshes', {})}
+    digest.update(json.dumps(geometry, sort_keys=True, default=str).encode())
+    for obj in list(geometry['objects']) + list(geometry['meshes'].values()):
+        if obj.get('type', 'mesh') == 'mesh' and 'path' in obj:
+            with open(mesh_path(base_dir, obj), 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def mesh_path(base_dir, obj):
+    return os.path.join(base_dir, obj['path'])
+
+
+def make_light(light):
+    kind = light['type']
+    if kind == 'directional':
+        return DirectionalLight(intensity=np.array(light['intensity']), direction=np.array(light['direction']))
+    if kind == 'point':
+        return PointLight(intensity=np.array(light['intensity']), position=np.array(light['position']),
+                          kc=light['kc'], kl=light['kl'], kq=light['kq'])
+    if kind == 'spot':
+        return SpotLight(intensity=np.array(light['intensity']), position=np.array(light['position']),
+                         direction=np.array(light['direction']), kc=light['kc'], kl=light['kl'], kq=light['kq'])
+    raise ValueError('unknown light type: ' + str(kind))
+
+
+def make_lights(description):
+    lights = [make_light(light) for light in description.get('lights', [])]
+    if 'light_cutoff' in description or 'light_samples' in description:
+        return LightSet(lights, cutoff=description.get('light_cutoff', 0.0), samples=description.get('light_samples'))
+    return lights
+
+
+# Builds one object of the scene, meshes are taken from mesh_arrays (the cached arrays of the mesh and its BVH)
+# when they are given. shared holds the meshes of "meshes" by name.
+def make_object(base_dir, obj, mesh_arrays=None, shared=None):
+    kind = obj['type']
+    if kind == 'plane':
+        return Plane(obj['normal'], obj['point'])
+    if kind == 'sphere':
+        return Sphere(obj['center'], obj['radius'])
+    if kind == 'triangle':
+        return Triangle(obj['a'], obj['b'], obj['c'])
+    if kind == 'mesh':
+        if mesh_arrays is not None:
+            arrays, bvh_arrays = mesh_arrays
+            return Mesh.from_arrays(arrays, BVH.from_arrays(bvh_arrays) if bvh_arrays is not None else None)
+        if 'path' in obj:
+            return load_mesh(mesh_path(base_dir, obj))
+        return Mesh(np.array(obj['vertices'], dtype=np.float64), np.array(obj['faces'], dtype=np.int64))
+    if kind == 'instance':
+        return Instance(shared[obj['mesh']], obj['transform'])
+    raise ValueError('unknown object type: ' + str(kind))
+
+
+def apply_material(obj, material, materials):
+    if isinstance(material, str):
+        material = materials[material]
+    obj.set_material(material['ambient'], material['diffuse'], material['specular'], material['shininess'],
+                     material['reflection'])
+    if isinstance(obj, Mesh):
+        obj.apply_materials_to_triangles()
+
+
+# Loads a scene file and returns a dict with the arguments of the render methods, so it can be rendered with
+#     render_scene(**load_scene('scene.json'))
+# The objects are returned as a Scene. Its BVH and the arrays and BVH of every mesh are kept in a cache directory
+# (cache_dir, by default .scene_cache next to the scene file) under the hash of the scene and mesh files. Loading
+# the same scene again memory maps them instead of reading the meshes and building the BVHs.
+def load_scene(path, use_cache=True, cache_dir=None):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return make_scene(read_scene_description(path), base_dir, use_cache, cache_dir)
+
+
+# load_scene for a scene description that is already read, mesh paths are relative to base_dir and the cache is in
+# cache_dir (by default .scene_cache in base_dir)
+def make_scene(description, base_dir, use_cache=True, cache_dir=None):
+    entry = None
+    if use_cache:
+        cache_dir = cache_dir or os.path.join(base_dir, CACHE_DIR_NAME)
+        entry = os.path.join(cache_dir, scene_hash(description, base_dir))
+    cached = read_cache(entry) if entry is not None and os.path.isdir(entry) else None
+
+    shared = {}
+    for i, name in enumerate(sorted(description.get('meshes', {}))):
+        obj = dict(description['meshes'][name], type='mesh')
+        shared[name] = make_object(base_dir, obj, cached['shared'][i] if cached is not None else None)
+
+    materials = description.get('materials', {})
+    objects = []
+    for i, obj in enumerate(description.get('objects', [])):
+        current = make_object(base_dir, obj,
+                              cached['meshes'][i] if cached is not None and obj['type'] == 'mesh' else None, shared)
+        if 'material' in obj:
+            apply_material(current, obj['material'], materials)
+        objects.append(current)
+    scene_bvh = BVH.from_arrays(cached['scene']) if cached is not None and cached['scene'] is not None else None
+    scene = Scene(objects, bvh=scene_bvh)
+    if entry is not None and cached is None:
+        write_cache(entry, scene, [shared[name] for name in sorted(shared)])
+
+    return {
+        'camera': np.array(description['camera'], dtype=np.float64),
+        'ambient': np.array(description['ambient'], dtype=np.float64),
+        'lights': make_lights(description),
+        'objects': scene,
+        'screen_size': tuple(description.get('screen_size', DEFAULT_SCREEN_SIZE)),
+        'max_depth': description.get('max_depth', DEFAULT_MAX_DEPTH),
+    }
+
+
+# A cache entry is a directory of .npy files, one per array: scene_<name>.npy for the BVH of the scene,
+# mesh<i>_<name>.npy, mesh<i>_bvh_<name>.npy for the mesh that is object i and shared<i>_<name>.npy,
+# shared<i>_bvh_<name>.npy for the i-th mesh of "meshes" (by sorted name). manifest.json lists what is there.
+# The entry is written to a temporary directory and renamed into place, so a half written entry is never read.
+def write_cache(entry, scene, shared=()):
+    manifest = {'version': CACHE_VERSION, 'scene': scene.bvh is not None, 'meshes': {}, 'shared': []}
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    try:
+        if scene.bvh is not None:
+            save_arrays(tmp, 'scene_', scene.bvh.to_arrays())
+        for i, obj in enumerate(scene):
+            if isinstance(obj, Mesh):
+                save_mesh(tmp, 'mesh{}_'.format(i), obj)
+                manifest['meshes'][str(i)] = obj.bvh is not None
+        for i, mesh in enumerate(shared):
+            save_mesh(tmp, 'shared{}_'.format(i), mesh)
+            manifest['shared'].append(mesh.bvh is not None)
+        with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp, entry)
+    except OSError:
+        # Another process wrote the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def save_mesh(directory, prefix, mesh):
+    save_arrays(directory, prefix, mesh.to_arrays())
+    if mesh.bvh is not None:
+        save_arrays(directory, prefix + 'bvh_', mesh.bvh.to_arrays())
+
+
+def save_arrays(directory, prefix, arrays):
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, prefix + name + '.npy'), np.ascontiguousarray(array))
+
+
+def load_arrays(directory, prefix, names):
+    return {name: np.load(os.path.join(directory, prefix + name + '.npy'), mmap_mode='r') for name in names}
+
+
+def load_mesh_arrays(directory, prefix, has_bvh):
+    bvh_arrays = load_arrays(directory, prefix + 'bvh_', BVH.ARRAYS) if has_bvh else None
+    return load_arrays(directory, prefix, Mesh.ARRAYS), bvh_arrays
+
+
+# Returns {'scene': scene BVH arrays or None, 'meshes': {object index: (mesh arrays, BVH arrays or None)},
+#          'shared': [(mesh arrays, BVH arrays or None) of the meshes of "meshes" by sorted name]}
+def read_cache(entry):
+    with open(os.path.join(entry, 'manifest.json')) as f:
+        manifest = json.load(f)
+    return {
+        'scene': load_arrays(entry, 'scene_', BVH.ARRAYS) if manifest['scene'] else None,
+        'meshes': {int(i): load_mesh_arrays(entry, 'mesh{}_'.format(i), has_bvh)
+                   for i, has_bvh in manifest['meshes'].items()},
+        'shared': [load_mesh_arrays(entry, 'shared{}_'.format(i), has_bvh)
+                   for i, has_bvh in enumerate(manifest['shared'])],
+    }
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'hw3'))
+sys.path.append(os.path.join(ROOT, 'hw1'))
+
+from ex1_loader import load_ex1  # noqa: E402,F401
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from hw3 import render_scene, render_scene_batched, render_scene_parallel, your_own_scene
+from helper_classes import Mesh, Plane, SpotLight, Triangle
+
+SIZE = (24, 16)
+
+
+def mesh_scene():
+    camera, lights, objects = your_own_scene()
+    mesh = Mesh(np.array([[-1, -1, -2], [1, -1, -2], [0, -1, -1], [0, 1, -1.5]]),
+                np.array([[0, 2, 1], [0, 1, 3], [0, 2, 3], [1, 3, 2]]))
+    mesh.set_material([0.3, 0.5, 0], [0.3, 0.5, 0], [0.3, 0.3, 0.3], 10, 0.5)
+    mesh.apply_materials_to_triangles()
+    triangle = Triangle([1, -1, -2], [0.5, 1, -1.5], [0.5, -1, -1])
+    triangle.set_material([1, 0, 0], [1, 0, 0], [0, 0, 0], 100, 0.5)
+    spot = SpotLight(intensity=np.array([0, 0, 1]), position=np.array([0.5, 0.5, 0]), direction=[0, 0, 1], kc=0.1,
+                     kl=0.1, kq=0.1)
+    return camera, np.array([0.1, 0.2, 0.3]), lights + [spot], objects[:1] + [mesh, triangle] + objects[1:]
+
+
+def scenes():
+    camera, lights, objects = your_own_scene()
+    return {'spheres': (camera, np.array([0.1] * 3), lights, objects), 'mesh': mesh_scene()}
+
+
+@pytest.mark.parametrize('name', ['spheres', 'mesh'])
+def test_batched_matches_scalar(name):
+    camera, ambient, lights, objects = scenes()[name]
+    scalar = render_scene(camera, ambient, lights, objects, SIZE, 3)
+    batched = render_scene_batched(camera, ambient, lights, objects, SIZE, 3, tile_size=8)
+    np.testing.assert_allclose(batched, scalar, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('name', ['spheres', 'mesh'])
+def test_parallel_matches_batched(name):
+    camera, ambient, lights, objects = scenes()[name]
+    batched = render_scene_batched(camera, ambient, lights, objects, SIZE, 3, tile_size=8)
+    parallel = render_scene_parallel(camera, ambient, lights, objects, SIZE, 3, tile_size=8, workers=2)
+    np.testing.assert_array_equal(parallel, batched)
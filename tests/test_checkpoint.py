@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from hw3 import render_scene_batched, render_scene_to_file
+from helper_classes import Plane, PointLight, Sphere
+
+
+def make_scene(center=(0, 0, -1)):
+    sphere = Sphere(list(center), 0.5)
+    sphere.set_material([1, 0, 0], [1, 0, 0], [0.3, 0.3, 0.3], 100, 0.5)
+    floor = Plane([0, 1, 0], [0, -0.5, 0])
+    floor.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [1, 1, 1], 1000, 0.5)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([1, 1.5, 1]), kc=0.1, kl=0.1, kq=0.1)
+    return np.array([0.1, 0.1, 0.1]), [light], [sphere, floor]
+
+
+def interrupt(path, finished):
+    with open(path + '.tiles') as f:
+        lines = f.read().split('\n')
+    with open(path + '.tiles', 'w') as f:
+        f.write('\n'.join(lines[:1 + finished]) + '\n')
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / 'image.npy')
+    camera = np.array([0, 0, 1])
+    ambient, lights, objects = make_scene()
+    render_scene_to_file(camera, ambient, lights, objects, (40, 30), 2, path, tile_size=16)
+    interrupt(path, 2)
+    ambient, lights, objects = make_scene()
+    image = render_scene_to_file(camera, ambient, lights, objects, (40, 30), 2, path, tile_size=16)
+    np.testing.assert_array_equal(image, render_scene_batched(camera, ambient, lights, objects, (40, 30), 2))
+
+
+@pytest.mark.parametrize('camera, center', [([0, 0.5, 1], (0, 0, -1)), ([0, 0, 1], (0.2, 0, -1))])
+def test_refuses_another_scene(tmp_path, camera, center):
+    path = str(tmp_path / 'image.npy')
+    ambient, lights, objects = make_scene()
+    render_scene_to_file(np.array([0, 0, 1]), ambient, lights, objects, (40, 30), 2, path, tile_size=16)
+    interrupt(path, 2)
+    ambient, lights, objects = make_scene(center)
+    with pytest.raises(ValueError):
+        render_scene_to_file(np.array(camera), ambient, lights, objects, (40, 30), 2, path, tile_size=16)
+
+
+@pytest.mark.parametrize('length', [0, 10])
+def test_refuses_a_truncated_header(tmp_path, length):
+    path = str(tmp_path / 'image.npy')
+    camera = np.array([0, 0, 1])
+    ambient, lights, objects = make_scene()
+    render_scene_to_file(camera, ambient, lights, objects, (40, 30), 2, path, tile_size=16)
+    with open(path + '.tiles') as f:
+        header = f.readline()
+    with open(path + '.tiles', 'w') as f:
+        f.write(header[:length])
+    with pytest.raises(ValueError, match='belongs to a render'):
+        render_scene_to_file(camera, ambient, lights, objects, (40, 30), 2, path, tile_size=16)
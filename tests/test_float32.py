@@ -0,0 +1,28 @@
+import numpy as np
+from hw3 import render_scene_batched
+from helper_classes import Plane, PointLight, Sphere
+
+
+def reflective_scene():
+    sphere_a = Sphere([-0.5, 0.2, -1], 0.5)
+    sphere_a.set_material([1, 0, 0], [1, 0, 0], [0.3, 0.3, 0.3], 100, 1)
+    sphere_b = Sphere([0.8, 0, -0.5], 0.3)
+    sphere_b.set_material([0, 1, 0], [0, 1, 0], [0.3, 0.3, 0.3], 100, 0.2)
+    floor = Plane([0, 1, 0], [0, -0.3, 0])
+    floor.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [1, 1, 1], 1000, 0.5)
+    background = Plane([0, 0, 1], [0, 0, -30])
+    background.set_material([0.2, 0.2, 0.2], [0.2, 0.2, 0.2], [0.2, 0.2, 0.2], 1000, 0.5)
+    light = PointLight(intensity=np.array([1, 1, 1]), position=np.array([1, 1.5, 1]), kc=0.1, kl=0.1, kq=0.1)
+    return np.array([0, 0, 1]), np.array([0.1, 0.2, 0.3]), [light], [sphere_a, sphere_b, floor, background], 3
+
+
+def test_float32_error_bound():
+    camera, ambient, lights, objects, max_depth = reflective_scene()
+    reference = render_scene_batched(camera, ambient, lights, objects, (160, 120), max_depth)
+    image = render_scene_batched(camera, ambient, lights, objects, (160, 120), max_depth, dtype=np.float32)
+    assert image.dtype == np.float32
+    error = np.abs(image - reference).max(axis=2)
+    # A few edge pixels flip to the other side of their edge, the rest are within float32 rounding
+    assert error.max() < 0.1
+    assert np.mean(error > 1e-4) < 2e-3
+    assert np.median(error) < 1e-6
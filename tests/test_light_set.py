@@ -0,0 +1,31 @@
+import numpy as np
+from hw3 import render_scene_batched, render_scene_parallel
+from helper_classes import LightSet, Plane, PointLight, Sphere
+
+
+def many_lights_scene():
+    rng = np.random.default_rng(1)
+    floor = Plane([0, 1, 0], [0, -1, 0])
+    floor.set_material([0.1] * 3, [0.6] * 3, [0.3] * 3, 10, 0.3)
+    objects = [floor]
+    for i in range(4):
+        sphere = Sphere([-1.5 + i, -0.6, -2.5], 0.3)
+        sphere.set_material(*rng.uniform(0.1, 0.9, (3, 3)), 20, 0.3)
+        objects.append(sphere)
+    lights = [PointLight(intensity=rng.uniform(0, 0.3, 3), position=rng.uniform([-3, -0.9, -4], [3, 2, 0]), kc=1,
+                         kl=0.5, kq=2) for _ in range(40)]
+    return np.array([0, 0, 1]), np.array([0.1] * 3), lights, objects
+
+
+def test_sampled_lights_do_not_depend_on_the_tiles():
+    camera, ambient, lights, objects = many_lights_scene()
+    light_set = LightSet(lights, cutoff=0.005, samples=4, seed=7)
+    batched = render_scene_batched(camera, ambient, light_set, objects, (48, 32), 2, tile_size=16)
+    parallel = render_scene_parallel(camera, ambient, light_set, objects, (48, 32), 2, tile_size=16, workers=2)
+    np.testing.assert_array_equal(parallel, batched)
+    # Other tiles only change the rounding, a different draw of the lights would change the colors by far more
+    one_tile = render_scene_batched(camera, ambient, light_set, objects, (48, 32), 2)
+    np.testing.assert_allclose(one_tile, batched, rtol=0, atol=1e-12)
+    other_seed = render_scene_batched(camera, ambient, LightSet(lights, cutoff=0.005, samples=4, seed=8), objects,
+                                      (48, 32), 2, tile_size=16)
+    assert not np.array_equal(other_seed, batched)
@@ -0,0 +1,40 @@
+import numpy as np
+from helper_classes import Mesh
+from mesh_io import load_mesh
+
+VERTICES = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0.5]], dtype=np.float32)
+FACES = np.array([[0, 1, 2], [1, 3, 2]], dtype=np.int32)
+
+
+def write_binary_ply(path):
+    header = ('ply\nformat binary_little_endian 1.0\nelement vertex {}\nproperty float x\nproperty float y\n'
+              'property float z\nelement face {}\nproperty list uchar int vertex_indices\nend_header\n').format(
+        len(VERTICES), len(FACES))
+    record = np.dtype([('n', 'u1'), ('i', '<i4', 3)])
+    faces = np.zeros(len(FACES), dtype=record)
+    faces['n'], faces['i'] = 3, FACES
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(VERTICES.astype('<f4').tobytes())
+        f.write(faces.tobytes())
+
+
+def test_binary_ply_is_not_copied(tmp_path):
+    path = str(tmp_path / 'mesh.ply')
+    write_binary_ply(path)
+    mesh = load_mesh(path)
+    assert mesh.vertices.dtype == np.float32 and mesh.faces.dtype == np.int32
+    assert np.shares_memory(mesh.vertices, mesh.v_list) and np.shares_memory(mesh.faces, mesh.f_list)
+    reference = Mesh(VERTICES.astype(np.float64), FACES.astype(np.int64))
+    for name in ('v0', 'edge1', 'edge2', 'normals'):
+        assert getattr(mesh, name).dtype == np.float64
+        np.testing.assert_array_equal(getattr(mesh, name), getattr(reference, name))
+
+
+def test_obj_accepts_mmap(tmp_path):
+    path = str(tmp_path / 'mesh.obj')
+    with open(path, 'w') as f:
+        f.write(''.join('v {} {} {}\n'.format(*v) for v in VERTICES))
+        f.write(''.join('f {} {} {}\n'.format(*(face + 1)) for face in FACES))
+    mesh = load_mesh(path, mmap=False)
+    np.testing.assert_array_equal(mesh.faces, FACES)
@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import pytest
+from render_service import RenderService, ResultCache, job_key, read_job
+
+MESH = 'v 0 0 -1\nv 1 0 -1\nv 0 1 -1\nf 1 2 3\n'
+
+
+@pytest.fixture
+def scene_root(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'meshes').mkdir(parents=True)
+    (root / 'meshes' / 'triangle.obj').write_text(MESH)
+    (tmp_path / 'secret.obj').write_text(MESH)
+    os.symlink(str(tmp_path / 'secret.obj'), str(root / 'meshes' / 'link.obj'))
+    return str(root)
+
+
+def mesh_scene(path, shared=False):
+    if shared:
+        return {'meshes': {'m': {'path': path}}, 'objects': [{'type': 'instance', 'mesh': 'm', 'transform': None}]}
+    return {'objects': [{'type': 'mesh', 'path': path}]}
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_mesh_paths_stay_inside_the_scene_root(scene_root, shared):
+    job = read_job({'scene': mesh_scene('meshes/triangle.obj', shared)}, scene_root)
+    assert job['base_dir'] == os.path.realpath(scene_root)
+    for path in ['../secret.obj', os.path.join(os.path.dirname(scene_root), 'secret.obj'), 'meshes/link.obj']:
+        with pytest.raises(ValueError):
+            read_job({'scene': mesh_scene(path, shared)}, scene_root)
+
+
+def test_cached_result(scene_root, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1 << 20)
+    service = RenderService(cache, workers=1, scene_root=scene_root)
+    try:
+        request = {'scene': mesh_scene('meshes/triangle.obj'), 'format': 'npy'}
+        cache.put(job_key(read_job(request, scene_root)) + '.npy', b'image')
+        assert asyncio.run(service.render(request)) == (b'image', 'npy', 'hit')
+    finally:
+        service.close()
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+from conftest import ROOT, load_ex1
+
+
+def make_images(directory, count=3):
+    rng = np.random.default_rng(0)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        plt.imsave(os.path.join(directory, 'frame{}.png'.format(i)), rng.integers(0, 255, (12, 16, 3), dtype=np.uint8))
+
+
+def test_pool_falls_back_when_loaded_by_path(tmp_path):
+    ex1 = load_ex1()
+    make_images(str(tmp_path / 'in'))
+    with pytest.warns(RuntimeWarning):
+        names = ex1.resize_directory(str(tmp_path / 'in'), str(tmp_path / 'out'), (6, 8))
+    assert names == ['frame0.png', 'frame1.png', 'frame2.png']
+    assert plt.imread(str(tmp_path / 'out' / 'frame0.png')).shape[:2] == (6, 8)
+
+
+def test_explicit_workers_are_not_dropped(tmp_path):
+    ex1 = load_ex1()
+    make_images(str(tmp_path / 'in'))
+    with pytest.raises(RuntimeError):
+        ex1.resize_directory(str(tmp_path / 'in'), str(tmp_path / 'out'), (6, 8), workers=2)
+
+
+def test_prefetch_thread_stops_with_its_consumer():
+    ex1 = load_ex1()
+    threads = threading.active_count()
+    frames = ex1.prefetch(iter(range(1000)), 2)
+    assert next(frames) == 0
+    frames.close()
+    assert threading.active_count() == threads
+
+
+def test_command_line(tmp_path):
+    make_images(str(tmp_path / 'in'), 2)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'hw1', 'ex1.py'), str(tmp_path / 'in'),
+                             str(tmp_path / 'out'), '6', '8', '--workers', '2'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == ['frame0.png', 'frame1.png']
+
+
+def test_pyramid_levels_reach_the_seam_search(tmp_path):
+    ex1 = load_ex1()
+    frames = [np.random.default_rng(i).integers(0, 256, (24, 40, 3), dtype=np.uint8) for i in range(2)]
+    resized = list(ex1.resize_frames(frames, (24, 30), 'seam_carving', workers=0, pyramid_levels=1))
+    for frame, image in zip(frames, resized):
+        np.testing.assert_array_equal(image, ex1.resize_image(frame, (24, 30), 'seam_carving', pyramid_levels=1))
+    make_images(str(tmp_path / 'in'), 1)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'hw1', 'ex1.py'), str(tmp_path / 'in'),
+                             str(tmp_path / 'out'), '12', '10', '--method', 'seam_carving', '--pyramid-levels', '1',
+                             '--workers', '0'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,125 @@
+import math
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+from conftest import load_ex1
+
+ex1 = load_ex1()
+
+
+def random_image(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+# The per pixel loops of the first version of ex1.py, the vectorized functions must keep their results
+
+def loop_greyscale(image):
+    return sum(w * image[:, :, c] for c, w in enumerate(ex1.greyscale_wt))
+
+
+def loop_gradient_magnitude(image):
+    greyscale = loop_greyscale(image)
+    height, width = greyscale.shape
+    gradient = np.zeros((height, width))
+    for i in range(height):
+        for j in range(width):
+            dx = greyscale[(i + 1) % height, j] - greyscale[i, j]
+            dy = greyscale[i, (j + 1) % width] - greyscale[i, j]
+            gradient[i, j] = np.sqrt(np.power(dx, 2) + np.power(dy, 2))
+    return gradient
+
+
+def loop_cost_matrix(image):
+    energy_map, greyscale = loop_gradient_magnitude(image), loop_greyscale(image)
+    height, width = energy_map.shape
+    M = energy_map.copy()
+    backtrack = np.zeros_like(M, dtype=int)
+    for i in range(1, height):
+        for j in range(width):
+            middle = abs(greyscale[i, j + 1] - greyscale[i, j - 1]) if 0 < j < width - 1 else 0
+            costs = [sys.maxsize, M[i - 1, j] + middle, sys.maxsize]
+            if j > 0:
+                costs[0] = M[i - 1, j - 1] + middle + abs(greyscale[i - 1, j] - greyscale[i, j - 1])
+            if j < width - 1:
+                costs[2] = M[i - 1, j + 1] + middle + abs(greyscale[i, j + 1] - greyscale[i - 1, j])
+            M[i, j] += min(costs)
+            lo = max(j - 1, 0)
+            backtrack[i, j] = lo + np.argmin(M[i - 1, lo:j + 2])
+    return M, backtrack
+
+
+def loop_bilinear(image, new_shape):
+    in_height, in_width, c = image.shape
+    out_height, out_width = new_shape
+    new_image = np.zeros((out_height, out_width, c))
+    w_scale, h_scale = in_width / out_width, in_height / out_height
+    for i in range(out_height):
+        for j in range(out_width):
+            x, y = i * h_scale, j * w_scale
+            x_floor, x_ceil = math.floor(x), min(in_height - 1, math.ceil(x))
+            y_floor, y_ceil = math.floor(y), min(in_width - 1, math.ceil(y))
+            if x_ceil == x_floor and y_ceil == y_floor:
+                q = image[int(x), int(y)]
+            elif x_ceil == x_floor:
+                q = image[int(x), y_floor] * (y_ceil - y) + image[int(x), y_ceil] * (y - y_floor)
+            elif y_ceil == y_floor:
+                q = image[x_floor, int(y)] * (x_ceil - x) + image[x_ceil, int(y)] * (x - x_floor)
+            else:
+                q1 = image[x_floor, y_floor] * (x_ceil - x) + image[x_ceil, y_floor] * (x - x_floor)
+                q2 = image[x_floor, y_ceil] * (x_ceil - x) + image[x_ceil, y_ceil] * (x - x_floor)
+                q = q1 * (y_ceil - y) + q2 * (y - y_floor)
+            new_image[i, j] = q
+    return new_image.astype(np.uint8)
+
+
+def test_gradient_magnitude():
+    image = random_image(9, 13)
+    np.testing.assert_allclose(ex1.gradient_magnitude(image, ex1.greyscale_wt), loop_gradient_magnitude(image),
+                               rtol=1e-12)
+
+
+def test_cost_matrix():
+    image = random_image(9, 13)
+    M, backtrack = ex1.calculate_cost_matrix(image)
+    expected_M, expected_backtrack = loop_cost_matrix(image)
+    np.testing.assert_allclose(M, expected_M, rtol=1e-12)
+    np.testing.assert_array_equal(backtrack[1:], expected_backtrack[1:])
+
+
+def test_incremental_seams_match_recomputing():
+    image = random_image(12, 16, seed=1)
+    seams, carved = ex1.get_vertical_seams(image, 6)
+    expected = image
+    for seam in seams:
+        M, backtrack = ex1.calculate_cost_matrix(expected)
+        assert ex1.find_seam(M, backtrack) == seam
+        expected = ex1.remove_seam(expected, seam)
+    np.testing.assert_array_equal(carved, expected)
+
+
+@pytest.mark.parametrize('new_shape', [(17, 23), (71, 97), (30, 40)])
+def test_bilinear(new_shape):
+    image = random_image(30, 40, seed=2)
+    np.testing.assert_array_equal(ex1.reshape_bilinear(image, new_shape), loop_bilinear(image, new_shape))
+
+
+def test_gradient_magnitude_buffers_are_reused():
+    image = random_image(400, 600)
+    out, greyscale, scratch = (np.empty((400, 600)) for _ in range(3))
+    tracemalloc.start()
+    result = ex1.gradient_magnitude(image, ex1.greyscale_wt, out=out, greyscale_out=greyscale, scratch=scratch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert result is out
+    # Only the fixed size casting buffers of the ufuncs, no array of the image size
+    assert peak < out.nbytes / 5
+    np.testing.assert_array_equal(out, ex1.gradient_magnitude(image, ex1.greyscale_wt))
+
+
+def test_float32_seams():
+    image = random_image(12, 16, seed=1)
+    seams, carved = ex1.get_vertical_seams(image, 4, dtype=np.float32)
+    assert carved.shape == (12, 12, 3)
+    assert len(seams) == 4
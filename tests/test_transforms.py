@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from helper_classes import AnimatedScene, Object3D, Sphere, rotation_matrix, scale_matrix, translation_matrix
+
+
+def test_sphere_similarity_transform():
+    sphere = Sphere([1, 0, 0], 0.5)
+    moved = sphere.transformed(translation_matrix([0, 2, 0]) @ rotation_matrix([0, 0, 1], np.pi / 2) @
+                               scale_matrix(3))
+    np.testing.assert_allclose(moved.center, [0, 5, 0], atol=1e-12)
+    assert moved.radius == pytest.approx(1.5)
+
+
+@pytest.mark.parametrize('transform', [scale_matrix([1, 2, 1]), scale_matrix(0),
+                                       np.array([[1, 0.5, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])])
+def test_sphere_rejects_other_transforms(transform):
+    with pytest.raises(ValueError):
+        Sphere([1, 0, 0], 0.5).transformed(transform)
+
+
+class Fixed(Object3D):
+    pass
+
+
+def test_animated_scene_rejects_objects_without_transformed():
+    sphere = Sphere([1, 0, 0], 0.5)
+    scene = AnimatedScene([sphere, Fixed()])
+    assert scene.get_frame({0: translation_matrix([0, 1, 0])})[0].center[1] == pytest.approx(1)
+    with pytest.raises(TypeError, match='Fixed objects cannot be transformed'):
+        scene.get_frame({1: translation_matrix([0, 1, 0])})